@@ -0,0 +1,21 @@
+from django.contrib import admin
+
+from .models import QueryFingerprint
+
+
+@admin.register(QueryFingerprint)
+class QueryFingerprintAdmin(admin.ModelAdmin):
+    list_display = ('view', 'short_sql', 'count', 'total_ms', 'p95_ms',
+                    'max_ms', 'updated',)
+    list_filter = ('view',)
+    search_fields = ('sql',)
+    readonly_fields = ('view', 'fingerprint', 'sql', 'count', 'total_ms',
+                       'max_ms', 'p95_ms', 'buckets', 'explain',
+                       'explained_at', 'updated',)
+
+    @admin.display(description='Запрос')
+    def short_sql(self, obj):
+        return obj.sql[:100]
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,114 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.authentication import get_authorization_header
+
+from recipes.models import Tag
+
+from .metrics import metrics
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+
+
+def get_catalogue_version():
+    """Текущая версия справочников (теги и ингредиенты)."""
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        # Начальное значение от времени: если ключ вытеснен из кэша,
+        # новая версия не совпадёт ни с одной из прежних.
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_tag_slugs():
+    """Слаги всех тегов из кэша справочников."""
+    key = f'catalogue:{get_catalogue_version()}:tag_slugs'
+    slugs = cache.get(key)
+    if slugs is None:
+        slugs = list(Tag.objects.values_list('slug', flat=True))
+        cache.set(key, slugs, CatalogueCacheMixin.cache_timeout)
+    return slugs
+
+
+class CatalogueCacheMixin:
+    """
+    Кэширует отрендеренные ответы list/retrieve справочников.
+
+    Ключ - версия справочников, адрес с query string и тип ответа, так что
+    изменение тегов или ингредиентов делает старые записи недостижимыми.
+    Попадание в кэш не обращается ни к ORM, ни к сериализаторам. Ответы
+    несут строгий ETag, на совпадающий If-None-Match - 304.
+    """
+    cache_timeout = getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 300)
+    cache_key = None
+
+    def perform_authentication(self, request):
+        # Справочники публичные: анонимный запрос не проверяется, а
+        # присланный токен проверяется, чтобы неверный получил 401.
+        if get_authorization_header(request):
+            super().perform_authentication(request)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request):
+        path = f'{request.get_full_path()}|{request.accepted_media_type}'
+        digest = hashlib.md5(path.encode()).hexdigest()
+        return f'catalogue:{get_catalogue_version()}:{digest}'
+
+    def cached(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            # Browsable API зависит от пользователя - не кэшируем.
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        metrics.inc('foodgram_cache_requests_total', (
+            ('cache', 'catalogue'),
+            ('result', 'miss' if entry is None else 'hit'),
+        ))
+        if entry is None:
+            self.cache_key = key
+            return handler(request, *args, **kwargs)
+        content, content_type, etag = entry
+        return self.conditional_response(
+            request, HttpResponse(content, content_type=content_type), etag
+        )
+
+    def conditional_response(self, request, response, etag):
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if self.cache_key is None or response.status_code != 200:
+            return response
+        response.render()
+        etag = quote_etag(hashlib.sha256(response.content).hexdigest())
+        cache.set(
+            self.cache_key,
+            (response.content, response['Content-Type'], etag),
+            self.cache_timeout
+        )
+        return self.conditional_response(request, response, etag)
@@ -0,0 +1,44 @@
+from django.conf import settings
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+from recipes.images import variant_urls
+
+from .metrics import metrics
+
+
+class CappedBase64ImageField(Base64ImageField):
+    """Base64 image that is size-checked before it is decoded."""
+    default_error_messages = {
+        'too_large': 'Картинка больше {max_bytes} байт.',
+        'too_many_pixels': 'Картинка больше {max_pixels} пикселей.',
+    }
+
+    def to_internal_value(self, base64_data):
+        limits = settings.RECIPE_IMAGES
+        if isinstance(base64_data, str):
+            payload = base64_data.rpartition(';base64,')[2]
+            # Four base64 characters encode three bytes.
+            if len(payload) // 4 * 3 > limits['MAX_BYTES']:
+                self.fail('too_large', max_bytes=limits['MAX_BYTES'])
+        file = super().to_internal_value(base64_data)
+        if file is not None:
+            metrics.observe('foodgram_image_decode_bytes', file.size)
+        image = getattr(file, 'image', None)
+        if image is not None:
+            width, height = image.size
+            if width * height > limits['MAX_PIXELS']:
+                self.fail('too_many_pixels', max_pixels=limits['MAX_PIXELS'])
+        return file
+
+
+class ImageVariantsField(serializers.Field):
+    """Read-only URLs of the rendered image variants of a recipe."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get('request'))
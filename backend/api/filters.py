@@ -1,33 +1,97 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe
+from recipes.models import FavoriteRecipe, Recipe, ShopRecipe
+from recipes.search import search_recipes
+
+from .cache import get_tag_slugs
+from .indexes import ingredient_index
 
 
 class IngredientSearchFilter(SearchFilter):
+    """
+    Поиск ингредиентов по началу названия.
+
+    Список отвечает из индекса в памяти (см. api.indexes), пока индекс
+    не готов - запросом в базу. Необязательный limit ограничивает выдачу.
+    """
     search_param = 'name'
+    limit_param = 'limit'
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_param])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit > 0 else None
+
+    def filter_queryset(self, request, queryset, view):
+        prefix = request.query_params.get(self.search_param, '')
+        if not prefix or view.action != 'list':
+            return super().filter_queryset(request, queryset, view)
+        limit = self.get_limit(request)
+        ingredients = ingredient_index.search(prefix, limit)
+        if ingredients is not None:
+            return ingredients
+        queryset = super().filter_queryset(request, queryset, view)
+        return queryset[:limit] if limit else queryset
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_slugs()]
 
 
 class RecipeFilter(filters.FilterSet):
+    """
+    Фильтры рецептов.
+
+    Теги, избранное и список покупок проверяются подзапросами EXISTS,
+    поэтому рецепты не дублируются и DISTINCT не нужен. Допустимые теги
+    берутся из кэша справочников, а не запросом на каждый запрос.
+    """
     author = filters.NumberFilter('author__id')
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='get_tags'
+    )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
     )
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_search')
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag__slug__in=value
+            )
+        ))
 
     def get_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favoriterecipes__user=self.request.user)
+            return queryset.filter(Exists(FavoriteRecipe.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk')
+            )))
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shoprecipes__user=self.request.user)
+            return queryset.filter(Exists(ShopRecipe.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk')
+            )))
+        return queryset
+
+    def get_search(self, queryset, name, value):
+        if value.strip():
+            return search_recipes(queryset, value)
         return queryset
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',)
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search',)
@@ -0,0 +1,111 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+from .cache import get_catalogue_version
+
+
+def normalize(value):
+    """Приводит строку к виду для поиска: регистр и ё не учитываются."""
+    return value.strip().lower().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов по префиксу названия в памяти процесса.
+
+    Названия хранятся отсортированным массивом, префиксный запрос - два
+    бинарных поиска. Индекс строится при первом обращении и пересобирается
+    при смене версии справочников (см. api.cache) и не реже чем раз в ttl
+    секунд, чтобы догнать изменения из других процессов при локальном кэше.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = ((), ())
+        self._built_at = None
+        self._version = None
+        self._generation = 0
+        self._bypassed = 0
+
+    @property
+    def is_warm(self):
+        if self._built_at is None:
+            return False
+        if self._version != get_catalogue_version():
+            return False
+        return self.ttl is None or time.monotonic() - self._built_at < self.ttl
+
+    @contextmanager
+    def bypass(self):
+        """Внутри блока search() возвращает None: поиск идёт в базу."""
+        self._bypassed += 1
+        try:
+            yield
+        finally:
+            self._bypassed -= 1
+
+    def invalidate(self):
+        self._generation += 1
+        self._built_at = None
+
+    def build(self):
+        generation = self._generation
+        version = get_catalogue_version()
+        pairs = sorted(
+            ((normalize(ingredient.name), ingredient)
+             for ingredient in Ingredient.objects.all()),
+            key=lambda pair: pair[0]
+        )
+        self._data = (
+            tuple(key for key, _ in pairs),
+            tuple(ingredient for _, ingredient in pairs)
+        )
+        if generation == self._generation:
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def search(self, prefix, limit=None):
+        """
+        Ингредиенты, название которых начинается с prefix.
+
+        Сначала точное совпадение, затем более короткие названия.
+        Возвращает None, если индекс холодный и его уже строит другой
+        поток или он обойдён через bypass() - тогда нужно искать в базе.
+        """
+        if self._bypassed:
+            return None
+        if not self.is_warm:
+            if not self._lock.acquire(blocking=False):
+                return None
+            try:
+                if not self.is_warm:
+                    self.build()
+            finally:
+                self._lock.release()
+        keys, ingredients = self._data
+        prefix = normalize(prefix)
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', start)
+
+        def rank(position):
+            return keys[position] != prefix, len(keys[position]), position
+
+        positions = range(start, end)
+        if limit is not None:
+            positions = heapq.nsmallest(limit, positions, key=rank)
+        else:
+            positions = sorted(positions, key=rank)
+        return [ingredients[position] for position in positions]
+
+
+ingredient_index = IngredientIndex(
+    ttl=getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+)
@@ -0,0 +1,160 @@
+"""
+Per-request performance measurements.
+
+The middlewares in api.middleware put a RequestMetrics object into a
+context variable for the duration of a request (collect_metrics()).
+Queries are counted through connection.execute_wrapper, everything else
+reports itself with measure(). Outside of such a request measure() only
+reads the context variable.
+"""
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.db import connections
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    """Timings of one request, in seconds."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.total = None
+        self.db_count = 0
+        self.timings = {'db': 0.0}
+        self.active = set()
+
+    def add(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+
+    def record_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() callback."""
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_count += 1
+            self.add('db', perf_counter() - start)
+
+    def finish(self):
+        self.total = perf_counter() - self.started
+        return self.total
+
+    def as_dict(self):
+        """Milliseconds per component, for logs."""
+        data = {
+            f'{name}_ms': round(duration * 1000, 2)
+            for name, duration in self.timings.items()
+        }
+        data['db_queries'] = self.db_count
+        if self.total is not None:
+            data['total_ms'] = round(self.total * 1000, 2)
+        return data
+
+    def server_timing(self):
+        """Value of the Server-Timing header."""
+        metrics = [
+            f'db;dur={self.timings["db"] * 1000:.1f};'
+            f'desc="{self.db_count} queries"'
+        ]
+        metrics += [
+            f'{name};dur={duration * 1000:.1f}'
+            for name, duration in self.timings.items() if name != 'db'
+        ]
+        if self.total is not None:
+            metrics.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+class QueryLog:
+    """connection.execute_wrapper() callback that keeps every query."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': self.alias,
+                'sql': sql,
+                'params': params,
+                'many': many,
+                'time_ms': (perf_counter() - start) * 1000,
+            })
+
+
+@contextmanager
+def log_queries():
+    """Yields the list that collects every query run inside the block."""
+    logs = [QueryLog(connection.alias) for connection in connections.all()]
+    with ExitStack() as stack:
+        for connection, log in zip(connections.all(), logs):
+            stack.enter_context(connection.execute_wrapper(log))
+        queries = []
+        try:
+            yield queries
+        finally:
+            queries.extend(
+                query for log in logs for query in log.queries
+            )
+
+
+@contextmanager
+def collect_metrics():
+    """
+    Collects the metrics of the block into a RequestMetrics object.
+
+    Inside an enclosing collect_metrics() block its object is reused, so
+    stacked middlewares share one set of query wrappers.
+    """
+    metrics = current_metrics.get()
+    if metrics is not None:
+        yield metrics
+        return
+    metrics = RequestMetrics()
+    token = current_metrics.set(metrics)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(metrics.record_query)
+                )
+            yield metrics
+    finally:
+        current_metrics.reset(token)
+
+
+@contextmanager
+def measure(name):
+    """
+    Adds the time spent in the block to the current request's metrics.
+
+    Nested blocks with the same name are counted once, by the outermost
+    one, so a serializer that renders other serializers is not counted
+    twice.
+    """
+    metrics = current_metrics.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    metrics.active.add(name)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.active.discard(name)
+        metrics.add(name, perf_counter() - start)
+
+
+class TimedSerializerMixin:
+    """Reports the time spent in to_representation as "serializer"."""
+
+    def to_representation(self, instance):
+        with measure('serializer'):
+            return super().to_representation(instance)
@@ -0,0 +1,251 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from .utils import (get_shoplist_pdf, iter_csv, iter_text, shoplist_line,
+                    shoplist_rows)
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+SHOPLIST_FORMATS = ('pdf', 'csv', 'txt')
+
+
+class BaseJobBackend:
+    """Runs callables outside the request thread."""
+
+    def submit(self, func, *args, **kwargs):
+        raise NotImplementedError
+
+
+class ImmediateJobBackend(BaseJobBackend):
+    """Runs jobs synchronously, e.g. for tests and management commands."""
+
+    def submit(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+class ThreadPoolJobBackend(BaseJobBackend):
+    """Runs jobs in a thread pool of the current worker process."""
+
+    def __init__(self, workers=2):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='jobs'
+        )
+
+    def submit(self, func, *args, **kwargs):
+        self.executor.submit(self.run, func, *args, **kwargs)
+
+    @staticmethod
+    def run(func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            # Nobody waits for the future, the error would be lost.
+            logger.exception('Job %s failed', func.__qualname__)
+        finally:
+            connections.close_all()
+
+
+@lru_cache(maxsize=None)
+def get_job_backend():
+    config = settings.JOBS
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def worker_id():
+    """Random id of this process, a new one after a fork or a restart."""
+    return _workers.setdefault(os.getpid(), uuid.uuid4().hex)
+
+
+_workers = {}
+
+
+class ShoplistJobStore:
+    """
+    Shopping list render jobs kept on disk.
+
+    Every job is a directory with status.json and, once done, the
+    rendered file. The file system is shared by all worker processes of
+    the container, so any worker can report a job's status. A queued or
+    running job whose worker is gone (restart, crash) is queued again by
+    the worker that reads it, a failed one can be retried and expires
+    after failed_ttl.
+    """
+
+    def __init__(self, root, ttl, failed_ttl, purge_interval):
+        self.root = root
+        self.ttl = ttl
+        self.failed_ttl = failed_ttl
+        self.purge_interval = purge_interval
+        self.purged = None
+
+    def path(self, job_id, *parts):
+        return os.path.join(self.root, job_id, *parts)
+
+    def write(self, job):
+        tmp_path = self.path(job['id'], 'status.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(job, file)
+        os.replace(tmp_path, self.path(job['id'], 'status.json'))
+
+    def update(self, job, **fields):
+        job.update(fields)
+        self.write(job)
+
+    def read(self, job_id):
+        try:
+            with open(self.path(job_id, 'status.json'),
+                      encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def create(self, user, file_format):
+        self.maybe_purge_expired()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.path(job_id))
+        job = {
+            'id': job_id,
+            'user': user.id,
+            'format': file_format,
+            'status': QUEUED,
+            'progress': 0,
+            'attempt': 1,
+            'created': time.time(),
+            'filename': (
+                f'{user} shoplist {datetime.date.today()}.{file_format}'
+            ),
+        }
+        self.write(job)
+        self.submit(job)
+        return job
+
+    def submit(self, job):
+        """Queues the job in this worker."""
+        self.update(job, pid=os.getpid(), worker=worker_id())
+        get_job_backend().submit(self.render, dict(job))
+
+    def retry(self, job):
+        """
+        Queues the job again as a new attempt.
+
+        Returns False if another worker has already started that attempt.
+        """
+        attempt = job.get('attempt', 1) + 1
+        try:
+            os.close(os.open(
+                self.path(job['id'], f'attempt-{attempt}'),
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY
+            ))
+        except FileExistsError:
+            return False
+        self.update(
+            job, status=QUEUED, progress=0, attempt=attempt,
+            created=time.time(), error=None, finished=None
+        )
+        self.submit(job)
+        return True
+
+    def get(self, job_id, user):
+        """Job of the user or None if there is no such (alive) job."""
+        job = self.read(job_id)
+        if job is None or job['user'] != user.id or self.is_expired(job):
+            return None
+        if self.is_orphaned(job) and not self.retry(job):
+            job = self.read(job_id) or job
+        return job
+
+    def result_path(self, job):
+        return self.path(job['id'], 'result')
+
+    def is_expired(self, job):
+        if job['status'] == FAILED:
+            finished = job.get('finished') or job['created']
+            return time.time() - finished > self.failed_ttl
+        return time.time() - job['created'] > self.ttl
+
+    @staticmethod
+    def is_orphaned(job):
+        """Queued or running in a worker process that no longer exists."""
+        pid = job.get('pid')
+        if job['status'] not in (QUEUED, RUNNING) or pid is None:
+            return False
+        if pid == os.getpid():
+            return job['worker'] != worker_id()
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    def maybe_purge_expired(self):
+        """Scans the job directories at most once per purge_interval."""
+        now = time.monotonic()
+        if self.purged is not None and now - self.purged < self.purge_interval:
+            return
+        self.purged = now
+        self.purge_expired()
+
+    def purge_expired(self):
+        if not os.path.isdir(self.root):
+            return
+        expired_before = time.time() - self.ttl
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                job = self.read(entry.name)
+                if (self.is_expired(job) if job is not None
+                        else entry.stat().st_mtime < expired_before):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    def render(self, job):
+        """Job body: renders the user's shopping list into the job dir."""
+        self.update(job, status=RUNNING, progress=10)
+        try:
+            user = User.objects.get(pk=job['user'])
+            rows = shoplist_rows(user).iterator()
+            if job['format'] == 'pdf':
+                lines = [shoplist_line(*row) for row in rows]
+                self.update(job, progress=50)
+                chunks = [get_shoplist_pdf(lines)]
+            elif job['format'] == 'csv':
+                chunks = (chunk.encode() for chunk in iter_csv(rows))
+            else:
+                chunks = (chunk.encode() for chunk in iter_text(rows))
+            with open(self.result_path(job), 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+        except Exception as error:
+            logger.exception('Shopping list job %s failed', job['id'])
+            try:
+                os.remove(self.result_path(job))
+            except FileNotFoundError:
+                pass
+            self.update(
+                job, status=FAILED, error=str(error), finished=time.time()
+            )
+            return
+        self.update(job, status=DONE, progress=100, finished=time.time())
+
+
+shoplist_jobs = ShoplistJobStore(
+    settings.SHOPLIST_JOBS['ROOT'], settings.SHOPLIST_JOBS['TTL'],
+    settings.SHOPLIST_JOBS['FAILED_TTL'],
+    settings.SHOPLIST_JOBS['PURGE_INTERVAL']
+)
@@ -0,0 +1,117 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+
+from api.filters import RecipeFilter
+from recipes.models import FavoriteRecipe, Recipe
+
+User = get_user_model()
+
+CASES = (
+    ('tags', {'tags': ['tag-0', 'tag-1']}),
+    ('tags + is_favorited', {'tags': ['tag-0', 'tag-1'], 'is_favorited': 1}),
+    ('tags + is_in_shopping_cart',
+     {'tags': ['tag-0', 'tag-1', 'tag-2'], 'is_in_shopping_cart': 1}),
+)
+
+
+def old_filter(queryset, params, user):
+    """The filters as they were: M2M joins and DISTINCT."""
+    queryset = queryset.filter(tags__slug__in=params['tags']).distinct()
+    if params.get('is_favorited'):
+        queryset = queryset.filter(favoriterecipes__user=user)
+    if params.get('is_in_shopping_cart'):
+        queryset = queryset.filter(shoprecipes__user=user)
+    return queryset
+
+
+def new_filter(queryset, params, user):
+    request = RequestFactory().get('/api/recipes/', params)
+    request.user = user
+    return RecipeFilter(request.GET, queryset, request=request).qs
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare plans and timings of the old (JOIN + DISTINCT) and the '
+        'new (EXISTS) recipe filters on a synthetic dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=0,
+            help='Top up the database to this many recipes with '
+                 'seed_synthetic (e.g. 1000000) before measuring.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=50000)
+
+    def seed(self, total, seed, batch_size):
+        """Top up the database with seed_synthetic to total recipes."""
+        missing = total - Recipe.objects.count()
+        if missing <= 0:
+            return
+        call_command(
+            'seed_synthetic', recipes=missing, users=max(missing // 100, 10),
+            favorites=missing // 20, carts=missing // 100, follows=0,
+            seed=seed, batch_size=batch_size, search_index=True,
+            stdout=self.stdout
+        )
+
+    @staticmethod
+    def bench_user():
+        """The user with the most favorites, so the filters have work."""
+        most_active = (
+            FavoriteRecipe.objects.values('user')
+            .annotate(favorites=Count('pk')).order_by('-favorites')
+            .values_list('user', flat=True).first()
+        )
+        if most_active is not None:
+            return User.objects.get(pk=most_active)
+        return User.objects.order_by('pk').first()
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        if connection.vendor == 'postgresql':
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS)'
+        elif connection.vendor == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN'
+        else:
+            prefix = 'EXPLAIN'
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return '\n'.join(
+                '    ' + ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+
+    def measure(self, title, queryset):
+        started = time.perf_counter()
+        count = queryset.count()
+        counted = time.perf_counter()
+        page = list(queryset.values_list('pk', flat=True)[:6])
+        finished = time.perf_counter()
+        self.stdout.write(
+            f'  {title}: count={count} '
+            f'COUNT {(counted - started) * 1000:.1f} ms, '
+            f'first page {(finished - counted) * 1000:.1f} ms, '
+            f'page={page}'
+        )
+        self.stdout.write(self.explain(queryset.order_by('-pub_date')[:6]))
+
+    def handle(self, *args, **options):
+        if options['recipes']:
+            self.seed(
+                options['recipes'], options['seed'], options['batch_size']
+            )
+        user = self.bench_user()
+        base = Recipe.objects.all()
+        for title, params in CASES:
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.measure('old', old_filter(base, params, user))
+            self.measure('new', new_filter(base, params, user))
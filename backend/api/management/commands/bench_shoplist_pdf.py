@@ -0,0 +1,50 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from api.utils import get_shoplist_pdf, register_font, shoplist_pdf_key
+
+
+class Command(BaseCommand):
+    help = 'Measure cold and warm shopping list PDF render latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+            help='Cart sizes (number of ingredient lines).'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Measurements per size, the best one is reported.'
+        )
+
+    def measure(self, lines, repeat, cold):
+        best = None
+        for _ in range(repeat):
+            if cold:
+                cache.delete(shoplist_pdf_key(lines))
+            started = time.perf_counter()
+            pdf = get_shoplist_pdf(lines)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000, len(pdf)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        register_font()
+        self.stdout.write(
+            f'font registration: '
+            f'{(time.perf_counter() - started) * 1000:.2f} ms (once)'
+        )
+        for size in options['sizes']:
+            lines = [
+                f'Ингредиент {number} (г) — {number * 10}'
+                for number in range(size)
+            ]
+            cold, size_bytes = self.measure(lines, options['repeat'], True)
+            warm, _ = self.measure(lines, options['repeat'], False)
+            self.stdout.write(
+                f'{size:>6} lines: cold {cold:9.2f} ms, '
+                f'warm {warm:7.3f} ms, {size_bytes} bytes'
+            )
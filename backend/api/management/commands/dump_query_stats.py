@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from api.models import QueryFingerprint
+from api.querystats import observer
+
+ORDERING = {
+    'total': '-total_ms',
+    'p95': '-p95_ms',
+    'count': '-count',
+    'max': '-max_ms',
+}
+
+
+class Command(BaseCommand):
+    help = 'Show the heaviest SQL query fingerprints per view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument(
+            '--order', choices=ORDERING, default='total',
+            help='Sort by total time, p95, number of runs or maximum.'
+        )
+        parser.add_argument(
+            '--view', help='Only fingerprints of this view, e.g. recipes-list.'
+        )
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Print the stored EXPLAIN output as well.'
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Delete the collected statistics instead of showing them.'
+        )
+
+    def handle(self, *args, **options):
+        observer.flush()
+        queryset = QueryFingerprint.objects.all()
+        if options['view']:
+            queryset = queryset.filter(view=options['view'])
+        if options['reset']:
+            deleted, _ = queryset.delete()
+            self.stdout.write(f'Удалено отпечатков: {deleted}')
+            return
+        rows = queryset.order_by(ORDERING[options['order']])
+        for row in rows[:options['limit']]:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{row.view}: {row.count} раз, всего {row.total_ms:.1f} мс, '
+                f'среднее {row.total_ms / row.count:.2f} мс, '
+                f'p95 {row.p95_ms:.1f} мс, максимум {row.max_ms:.1f} мс'
+            ))
+            self.stdout.write(f'  {row.sql}')
+            if options['explain'] and row.explain:
+                self.stdout.write('\n'.join(
+                    f'    {line}' for line in row.explain.splitlines()
+                ))
@@ -0,0 +1,324 @@
+import json
+import re
+from time import perf_counter
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.indexes import ingredient_index
+from api.instrumentation import log_queries
+from api.querystats import fingerprint
+from recipes.models import FavoriteRecipe, Recipe, ShopRecipe, Tag
+from users.models import Follow
+
+User = get_user_model()
+
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+ORDER_BY = re.compile(r'ORDER BY (.+?)(?: LIMIT | OFFSET |\)|$)')
+
+
+def heaviest(model, field):
+    """Id of the user with the most rows of model, None if it is empty."""
+    row = (
+        model.objects.values(field).annotate(rows=Count('pk'))
+        .order_by('-rows').first()
+    )
+    return row[field] if row else None
+
+
+def filter_columns(sql, table):
+    """Columns of table compared with a value in sql, in order."""
+    pattern = re.compile(
+        rf'"{table}"\."(\w+)"\s*(?:=|<|>|IN\b|LIKE\b)', re.IGNORECASE
+    )
+    return list(dict.fromkeys(pattern.findall(sql)))
+
+
+def order_columns(sql, table):
+    """Columns of table in the ORDER BY of sql, "-" marks DESC."""
+    match = ORDER_BY.search(sql)
+    if match is None:
+        return []
+    return [
+        ('-' if direction else '') + column
+        for column, direction in re.findall(
+            rf'"{table}"\."(\w+)"(\s+DESC)?', match.group(1)
+        )
+    ]
+
+
+def postgresql_findings(plan):
+    """(kind, table) of every Seq Scan and Sort node of a JSON plan."""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    findings = []
+
+    def relation(node):
+        if 'Relation Name' in node:
+            return node['Relation Name']
+        for child in node.get('Plans', ()):
+            name = relation(child)
+            if name:
+                return name
+        return None
+
+    def walk(node):
+        if node['Node Type'] == 'Seq Scan':
+            findings.append(('seq scan', node['Relation Name']))
+        elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+            findings.append(('sort', relation(node)))
+        for child in node.get('Plans', ()):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return findings
+
+
+def sqlite_findings(rows):
+    """(kind, table) of full table scans and temporary sort b-trees."""
+    findings = []
+    table = None
+    for *_, detail in rows:
+        words = detail.split()
+        if words[0] in ('SCAN', 'SEARCH'):
+            table = words[2] if words[1] == 'TABLE' else words[1]
+            if words[0] == 'SCAN' and ' USING ' not in detail:
+                findings.append(('seq scan', table))
+        elif detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+            findings.append(('sort', table))
+    return findings
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the hot API paths through the real views, EXPLAIN every '
+        'query they make and flag sequential scans and sorts on large '
+        'tables with the indexes that would avoid them. Meant for a '
+        'seeded local database (see seed_synthetic).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows', type=int, default=10000,
+            help='Only flag tables with at least this many rows.'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='Request as this user instead of the heaviest ones.'
+        )
+        parser.add_argument(
+            '--plans', action='store_true', help='Print every plan.'
+        )
+
+    def handle(self, *args, **options):
+        if not Recipe.objects.exists():
+            raise CommandError('В базе нет рецептов, сначала наполните её.')
+        self.options = options
+        self.models = {
+            model._meta.db_table: model for model in apps.get_models()
+        }
+        self.row_counts = {}
+        self.proposals = {}
+        self.factory = APIRequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        for title, user_id, method, path, data in self.hot_paths():
+            self.run_path(title, user_id, method, path, data)
+        self.report_proposals()
+
+    def hot_paths(self):
+        """(title, user id, method, path, query or body) of each path."""
+        user = self.options['user']
+        reader = user or heaviest(FavoriteRecipe, 'user')
+        buyer = user or heaviest(ShopRecipe, 'user')
+        follower = user or heaviest(Follow, 'follower')
+        author = heaviest(Recipe, 'author')
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        recipes = reverse('recipes-list')
+        paths = [
+            ('Рецепты', reader, 'get', recipes, {}),
+            ('Рецепты по тегам', reader, 'get', recipes, {'tags': tags}),
+            ('Рецепты автора', reader, 'get', recipes, {'author': author}),
+            ('Избранное', reader, 'get', recipes, {'is_favorited': 1}),
+            ('Избранное по тегам', reader, 'get', recipes,
+             {'is_favorited': 1, 'tags': tags}),
+            ('Рецепты в списке покупок', buyer, 'get', recipes,
+             {'is_in_shopping_cart': 1}),
+            ('Поиск рецептов', reader, 'get', recipes, {'search': 'суп'}),
+            ('Подписки', follower, 'get', reverse('follows-subscriptions'),
+             {'recipes_limit': 3}),
+            ('Лента', follower, 'get', reverse('recipes-feed'), {}),
+            ('Список покупок', buyer, 'get',
+             reverse('recipes-download-shopping-cart'), {'format': 'csv'}),
+            ('Поиск ингредиентов', None, 'get', reverse('ingredients-list'),
+             {'name': 'са'}),
+        ]
+        for name, model in (('favorite', FavoriteRecipe),
+                            ('shopping-cart', ShopRecipe)):
+            row = model.objects.order_by('pk').first()
+            if row is None:
+                continue
+            new_recipe = Recipe.objects.exclude(
+                pk__in=model.objects.filter(user=row.user_id).values('recipe')
+            ).order_by('-pk').first()
+            if new_recipe is not None:
+                paths.append((
+                    f'{name}: добавить', row.user_id, 'post',
+                    reverse(f'recipes-{name}', args=[new_recipe.pk]), None
+                ))
+            paths.append((
+                f'{name}: удалить', row.user_id, 'delete',
+                reverse(f'recipes-{name}', args=[row.recipe_id]), None
+            ))
+        return paths
+
+    def request(self, user_id, method, path, data):
+        if method == 'get':
+            request = self.factory.get(path, data)
+        else:
+            request = getattr(self.factory, method)(path, data, format='json')
+        if user_id is not None:
+            force_authenticate(request, user=User.objects.get(pk=user_id))
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        else:
+            response.render()
+        return response
+
+    def run_path(self, title, user_id, method, path, data):
+        # Write paths change nothing: the request and the EXPLAINs run in
+        # a transaction that is rolled back. The in-memory ingredient index
+        # is bypassed, so the search goes to the database.
+        with transaction.atomic(), ingredient_index.bypass():
+            start = perf_counter()
+            with log_queries() as queries:
+                response = self.request(user_id, method, path, data)
+            duration = (perf_counter() - start) * 1000
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{title}: {method.upper()} {path} -> '
+                f'{response.status_code}, {len(queries)} запросов, '
+                f'{duration:.1f} мс'
+            ))
+            seen = set()
+            for query in queries:
+                normalized, digest = fingerprint(query['sql'])
+                if (digest in seen or query['many']
+                        or not normalized.upper().startswith(EXPLAINED)):
+                    continue
+                seen.add(digest)
+                self.explain(query['sql'], query['params'])
+            transaction.set_rollback(True)
+
+    def explain(self, sql, params):
+        if connection.vendor == 'postgresql':
+            prefix = connection.ops.explain_query_prefix(
+                format='json', analyze=True, buffers=True
+            )
+        else:
+            prefix = connection.ops.explain_query_prefix()
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            rows = cursor.fetchall()
+        if connection.vendor == 'postgresql':
+            plan = rows[0][0]
+            findings = postgresql_findings(plan)
+            text = json.dumps(plan, indent=2, ensure_ascii=False)
+        elif connection.vendor == 'sqlite':
+            findings = sqlite_findings(rows)
+            text = '\n'.join(row[-1] for row in rows)
+        else:
+            findings = []
+            text = '\n'.join(' '.join(map(str, row)) for row in rows)
+        flagged = [
+            (kind, table) for kind, table in findings
+            if table in self.models
+            and self.row_count(table) >= self.options['min_rows']
+        ]
+        if not flagged and not self.options['plans']:
+            return
+        self.stdout.write(f'  {fingerprint(sql)[0][:200]}')
+        if self.options['plans']:
+            self.stdout.write('\n'.join(
+                f'    {line}' for line in text.splitlines()
+            ))
+        for kind, table in flagged:
+            self.stdout.write(self.style.WARNING(
+                f'    ! {kind} {table} (~{self.row_count(table)} строк)'
+            ))
+            self.propose(sql, table)
+
+    def row_count(self, table):
+        if table not in self.row_counts:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(
+                        'SELECT reltuples FROM pg_class WHERE relname = %s',
+                        [table]
+                    )
+                else:
+                    cursor.execute(
+                        f'SELECT COUNT(*) FROM '
+                        f'{connection.ops.quote_name(table)}'
+                    )
+                row = cursor.fetchone()
+            self.row_counts[table] = int(row[0]) if row else 0
+        return self.row_counts[table]
+
+    def propose(self, sql, table):
+        """Remembers an index on the filter and then the sort columns."""
+        fields = filter_columns(sql, table)
+        fields += [
+            column for column in order_columns(sql, table)
+            if column.lstrip('-') not in fields
+        ]
+        if not fields:
+            return
+        columns = [field.lstrip('-') for field in fields]
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, table)
+        for constraint in existing.values():
+            if (constraint['index'] or constraint['unique']) and (
+                constraint['columns'][:len(columns)] == columns
+            ):
+                return
+        self.proposals.setdefault(table, {})[tuple(fields)] = sql
+
+    def report_proposals(self):
+        if not self.proposals:
+            self.stdout.write(self.style.SUCCESS(
+                'Недостающих индексов не найдено.'
+            ))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'Предлагаемые индексы (Meta.indexes, затем makemigrations):'
+        ))
+        for table, proposals in self.proposals.items():
+            model = self.models[table]
+            self.stdout.write(f'  {model._meta.label}:')
+            for fields in proposals:
+                field_names = [
+                    ('-' if column.startswith('-') else '')
+                    + self.field_name(model, column.lstrip('-'))
+                    for column in fields
+                ]
+                name = '_'.join(
+                    [model._meta.model_name]
+                    + [field.lstrip('-') for field in field_names]
+                )[:26] + '_idx'
+                self.stdout.write(
+                    f'    models.Index(fields={field_names!r}, '
+                    f'name={name!r}),'
+                )
+
+    @staticmethod
+    def field_name(model, column):
+        for field in model._meta.concrete_fields:
+            if field.column == column:
+                return field.name
+        return column
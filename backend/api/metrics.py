@@ -0,0 +1,324 @@
+"""
+Prometheus metrics shared by all worker processes.
+
+Every process aggregates its metrics in memory and, at most once per
+METRICS['FLUSH_INTERVAL'] seconds, writes them to its own file in
+METRICS['ROOT'] (written to a temporary file, then os.replace), named by
+pid and process start time. The /api/metrics view merges the files of all
+live processes, so whichever worker answers the scrape reports the totals;
+no collector process is needed.
+
+The totals of a dead process are folded into archive.json before its file
+is deleted (like the multiprocess mode of prometheus_client), so merged
+counters never go down. A process is alive if its pid exists and has the
+start time from the file name, a reused pid does not count.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+HISTOGRAMS = {
+    'foodgram_request_duration_seconds': (
+        'API request latency by view.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'foodgram_request_queries': (
+        'Database queries per API request by view.',
+        (1, 2, 5, 10, 20, 50, 100, 200, 500),
+    ),
+    'foodgram_shoplist_pdf_render_seconds': (
+        'Shopping list PDF render time.',
+        (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    ),
+    'foodgram_image_decode_bytes': (
+        'Decoded size of uploaded recipe images.',
+        (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2,
+         10 * 1024 ** 2),
+    ),
+}
+COUNTERS = {
+    'foodgram_cache_requests_total': 'Cache lookups by cache and result.',
+}
+ARCHIVE = 'archive.json'
+LOCK = 'archive.lock'
+
+
+def process_start(pid):
+    """
+    Start time of the process in clock ticks since boot, None if there is
+    no such process. Without /proc the pid itself is all there is.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            stat = file.read()
+    except FileNotFoundError:
+        if os.path.isdir('/proc'):
+            return None
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass
+        return '0'
+    # The command name in parentheses may contain spaces.
+    return stat.rsplit(')', 1)[1].split()[19]
+
+
+def merge(snapshots):
+    """Sums snapshots into (counters, histograms) keyed by (name, labels)."""
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, {
+                'buckets': [0] * len(HISTOGRAMS[name][1]),
+                'sum': 0.0, 'count': 0,
+            })
+            for index, value in enumerate(histogram['buckets']):
+                total['buckets'][index] += value
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+
+def as_snapshot(counters, histograms):
+    return {
+        'counters': [
+            [name, labels, value]
+            for (name, labels), value in counters.items()
+        ],
+        'histograms': [
+            [name, labels, histogram]
+            for (name, labels), histogram in histograms.items()
+        ],
+    }
+
+
+def escape(value):
+    return (
+        str(value).replace('\\', r'\\').replace('\n', r'\n')
+        .replace('"', r'\"')
+    )
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{escape(value)}"' for name, value in labels)
+    return f'{{{pairs}}}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Counters and histograms of this process, flushed to a file."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+        atexit.register(self.flush_at_exit)
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.started = process_start(self.pid)
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.flushed = 0.0
+        self.flushed_once = False
+
+    @property
+    def config(self):
+        return settings.METRICS
+
+    def check_fork(self):
+        # A forked child starts from zero, not from the parent's data.
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels=(), value=1):
+        if not self.config['ENABLED']:
+            return
+        with self.lock:
+            self.check_fork()
+            self.counters[(name, tuple(labels))] += value
+        self.maybe_flush()
+
+    def observe(self, name, value, labels=()):
+        if not self.config['ENABLED']:
+            return
+        buckets = HISTOGRAMS[name][1]
+        key = (name, tuple(labels))
+        with self.lock:
+            self.check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0,
+                }
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            self.check_fork()
+            return as_snapshot(self.counters, {
+                key: dict(histogram, buckets=list(histogram['buckets']))
+                for key, histogram in self.histograms.items()
+            })
+
+    def path(self, file_name=None):
+        return os.path.join(
+            self.config['ROOT'],
+            file_name or f'{self.pid}-{self.started}.json'
+        )
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed >= self.config['FLUSH_INTERVAL']:
+            self.flush()
+
+    def flush(self):
+        self.flushed = time.monotonic()
+        snapshot = self.snapshot()
+        os.makedirs(self.config['ROOT'], exist_ok=True)
+        self.write(self.path(), snapshot)
+        if not self.flushed_once:
+            self.flushed_once = True
+            with self.archive_lock():
+                self.archive_dead()
+
+    @staticmethod
+    def write(path, snapshot):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temp_path, path)
+
+    def read(self, file_name):
+        try:
+            with open(self.path(file_name)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def is_alive(file_name):
+        pid, _, started = file_name[:-len('.json')].partition('-')
+        try:
+            return process_start(int(pid)) == started
+        except ValueError:
+            return False
+
+    def worker_files(self):
+        """Files of the other processes, alive or not."""
+        own_file = os.path.basename(self.path())
+        try:
+            names = os.listdir(self.config['ROOT'])
+        except FileNotFoundError:
+            return []
+        return [
+            name for name in names
+            if name.endswith('.json') and name not in (own_file, ARCHIVE)
+        ]
+
+    @contextmanager
+    def archive_lock(self):
+        """Serializes archiving and reading between processes."""
+        os.makedirs(self.config['ROOT'], exist_ok=True)
+        with open(self.path(LOCK), 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def archive_dead(self):
+        """
+        Adds the totals of dead processes to the archive and deletes their
+        files. Called under archive_lock().
+        """
+        dead = [
+            name for name in self.worker_files() if not self.is_alive(name)
+        ]
+        if not dead:
+            return
+        snapshots = [self.read(ARCHIVE) or as_snapshot({}, {})]
+        snapshots += filter(None, map(self.read, dead))
+        self.write(self.path(ARCHIVE), as_snapshot(*merge(snapshots)))
+        for file_name in dead:
+            try:
+                os.remove(self.path(file_name))
+            except FileNotFoundError:
+                pass
+
+    def flush_at_exit(self):
+        if self.pid == os.getpid() and (self.counters or self.histograms):
+            self.flush()
+
+    def collect(self):
+        """
+        Merged metrics of all processes and the archive, this process is
+        read from memory.
+        """
+        snapshots = [self.snapshot()]
+        with self.archive_lock():
+            self.archive_dead()
+            for file_name in self.worker_files() + [ARCHIVE]:
+                snapshot = self.read(file_name)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return merge(snapshots)
+
+    def exposition(self):
+        """Prometheus text format (version 0.0.4)."""
+        counters, histograms = self.collect()
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(
+                        f'{name}{format_labels(labels)} {format_value(value)}'
+                    )
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}',
+                      f'# TYPE {name} histogram']
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, value in zip(buckets, histogram['buckets']):
+                    cumulative += value
+                    bucket_labels = format_labels(
+                        labels + (('le', format_value(float(bound))),)
+                    )
+                    lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                inf_labels = format_labels(labels + (('le', '+Inf'),))
+                lines += [
+                    f'{name}_bucket{inf_labels} {histogram["count"]}',
+                    f'{name}_sum{format_labels(labels)} '
+                    f'{format_value(float(histogram["sum"]))}',
+                    f'{name}_count{format_labels(labels)} '
+                    f'{histogram["count"]}',
+                ]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,191 @@
+import base64
+import json
+import logging
+import random
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .instrumentation import collect_metrics, current_metrics, log_queries
+from .metrics import metrics as registry
+from .profiling import PROFILERS
+from .querystats import observer
+
+logger = logging.getLogger('api.timing')
+
+
+class ServerTimingMiddleware:
+    """
+    Measures DB, serializer, render and total time of API requests.
+
+    Sampled requests get a Server-Timing header; a structured log line is
+    written when the request took at least the threshold of its view
+    (SERVER_TIMING['THRESHOLDS'], milliseconds, keyed by view name).
+    """
+
+    def __init__(self, get_response):
+        self.config = settings.SERVER_TIMING
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (not request.path.startswith(self.config['PATH_PREFIX'])
+                or random.random() >= self.config['SAMPLE_RATE']):
+            return self.get_response(request)
+        with collect_metrics() as metrics:
+            response = self.get_response(request)
+        metrics.finish()
+        response['Server-Timing'] = metrics.server_timing()
+        self.log(request, response, metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        # Django renders the response right after this hook, the
+        # post-render callback closes the measurement.
+        metrics = current_metrics.get()
+        if metrics is not None:
+            start = perf_counter()
+            response.add_post_render_callback(
+                lambda response: metrics.add('render', perf_counter() - start)
+            )
+        return response
+
+    def log(self, request, response, metrics):
+        match = request.resolver_match
+        view = match.view_name if match else None
+        thresholds = self.config['THRESHOLDS']
+        threshold = thresholds.get(view, thresholds.get('default', 0))
+        if metrics.total * 1000 < threshold:
+            return
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            **metrics.as_dict(),
+        }
+        logger.info(json.dumps(record))
+
+
+class MetricsMiddleware:
+    """Records latency and query count histograms of every API request."""
+
+    def __init__(self, get_response):
+        self.config = settings.METRICS
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(self.config['PATH_PREFIX']):
+            return self.get_response(request)
+        start = perf_counter()
+        with collect_metrics() as metrics:
+            response = self.get_response(request)
+        duration = perf_counter() - start
+        match = request.resolver_match
+        labels = (
+            ('view', match.view_name if match else 'unmatched'),
+            ('method', request.method),
+        )
+        registry.observe(
+            'foodgram_request_duration_seconds', duration, labels
+        )
+        registry.observe('foodgram_request_queries', metrics.db_count, labels)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests of admins on demand.
+
+    A request with "X-Profile: prof|collapsed" or "_profile=prof|collapsed"
+    in the query string, sent by an admin, runs under cProfile (prof) or
+    a stack sampler (collapsed). Its response is replaced by a JSON report
+    with the original status, the timings, every SQL query and the
+    profile. Other requests only pay for the header and query checks.
+    """
+    header = 'HTTP_X_PROFILE'
+    param = '_profile'
+
+    def __init__(self, get_response):
+        self.config = settings.PROFILING
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (self.header not in request.META
+                and f'{self.param}=' not in request.META['QUERY_STRING']):
+            return self.get_response(request)
+        mode = request.META.get(self.header) or request.GET.get(self.param)
+        profiler_class = PROFILERS.get(mode)
+        if profiler_class is None or not self.is_admin(request):
+            return self.get_response(request)
+        return self.profile(request, profiler_class)
+
+    @staticmethod
+    def is_admin(request):
+        # DRF authenticates only inside the view, the token is checked
+        # here the same way; admin site sessions work as well.
+        try:
+            credentials = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        user = credentials[0] if credentials else request.user
+        return user.is_authenticated and (user.is_admin or user.is_superuser)
+
+    def profile(self, request, profiler_class):
+        profiler = profiler_class(interval=self.config['SAMPLE_INTERVAL'])
+        with log_queries() as queries, collect_metrics() as metrics:
+            profiler.start()
+            try:
+                response = self.get_response(request)
+                if response.streaming:
+                    # A streaming response does its work while being read.
+                    b''.join(response.streaming_content)
+            finally:
+                profiler.stop()
+        metrics.finish()
+        profile = profiler.result()
+        if profiler.format == 'prof':
+            profile = {'encoding': 'base64',
+                       'data': base64.b64encode(profile).decode()}
+        else:
+            profile = {'encoding': 'text', 'data': profile.decode()}
+        return JsonResponse({
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'timings': metrics.as_dict(),
+            'queries': [
+                dict(query, params=repr(query['params']),
+                     time_ms=round(query['time_ms'], 3))
+                for query in queries
+            ],
+            'profile': {'format': profiler.format, **profile},
+        }, json_dumps_params={'ensure_ascii': False})
+
+
+class QueryStatsMiddleware:
+    """Feeds the queries of sampled API requests to api.querystats."""
+
+    def __init__(self, get_response):
+        self.config = settings.QUERY_STATS
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (not request.path.startswith(self.config['PATH_PREFIX'])
+                or random.random() >= self.config['SAMPLE_RATE']):
+            return self.get_response(request)
+        with log_queries() as queries:
+            response = self.get_response(request)
+        match = request.resolver_match
+        observer.record(match.view_name if match else 'unmatched', queries)
+        return response
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.16 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(max_length=200, verbose_name='Представление')),
+                ('fingerprint', models.CharField(max_length=32, verbose_name='Отпечаток')),
+                ('sql', models.TextField(verbose_name='Запрос без литералов')),
+                ('count', models.PositiveBigIntegerField(default=0, verbose_name='Выполнений')),
+                ('total_ms', models.FloatField(default=0, verbose_name='Всего, мс')),
+                ('max_ms', models.FloatField(default=0, verbose_name='Максимум, мс')),
+                ('p95_ms', models.FloatField(default=0, verbose_name='p95, мс')),
+                ('buckets', models.JSONField(default=list, verbose_name='Гистограмма времени')),
+                ('explain', models.TextField(blank=True, verbose_name='План запроса')),
+                ('explained_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата плана')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Статистика запроса',
+                'verbose_name_plural': 'Статистика запросов',
+                'ordering': ['-total_ms'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='queryfingerprint',
+            constraint=models.UniqueConstraint(fields=('view', 'fingerprint'), name='UQ_query_fingerprint_view'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import models
+
+
+class QueryFingerprint(models.Model):
+    """Статистика SQL-запросов одного вида в одном представлении."""
+    view = models.CharField(
+        max_length=200,
+        verbose_name='Представление'
+    )
+    fingerprint = models.CharField(
+        max_length=32,
+        verbose_name='Отпечаток'
+    )
+    sql = models.TextField(verbose_name='Запрос без литералов')
+    count = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Выполнений'
+    )
+    total_ms = models.FloatField(default=0, verbose_name='Всего, мс')
+    max_ms = models.FloatField(default=0, verbose_name='Максимум, мс')
+    p95_ms = models.FloatField(default=0, verbose_name='p95, мс')
+    buckets = models.JSONField(
+        default=list,
+        verbose_name='Гистограмма времени'
+    )
+    explain = models.TextField(blank=True, verbose_name='План запроса')
+    explained_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата плана'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Обновлено'
+    )
+
+    class Meta:
+        verbose_name = 'Статистика запроса'
+        verbose_name_plural = 'Статистика запросов'
+        ordering = ['-total_ms']
+        constraints = [
+            models.UniqueConstraint(fields=['view', 'fingerprint'],
+                                    name='UQ_query_fingerprint_view')
+        ]
+
+    def __str__(self):
+        return f'{self.view}: {self.sql[:50]}'
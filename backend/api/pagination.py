@@ -1,5 +1,251 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+def estimate_count(queryset):
+    """
+    Cheap row count of the queryset.
+
+    PostgreSQL returns the planner's estimate (no scan); other databases
+    fall back to an exact COUNT.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def after(position, ordering, reverse=False):
+    """
+    Rows strictly after position in ordering, before it with reverse.
+
+    (a, b) after (x, y) is a > x OR (a = x AND b > y), with the comparison
+    flipped for descending fields.
+    """
+    condition = Q()
+    equal = {}
+    for order, value in zip(ordering, position):
+        name = order.lstrip('-')
+        lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+class CustomCursorPagination(CursorPagination):
+    """
+    Keyset pagination: no COUNT and no OFFSET on deep pages.
+
+    Unlike the DRF cursor, which keys on the first ordering field only and
+    skips ties with an OFFSET, the cursor holds every ordering field of
+    the row it points at and the page starts strictly after that row.
+    The ordering must end with a unique field.
+
+    The total is not computed unless ?estimate_count=1 is passed, then
+    an estimate is returned in "count".
+    """
+    page_size_query_param = 'limit'
+    estimate_count_query_param = 'estimate_count'
+    count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.estimate_count_query_param):
+            self.count = estimate_count(queryset)
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*(
+                order[1:] if order.startswith('-') else f'-{order}'
+                for order in self.ordering
+            ))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(after(
+                self.parse_position(queryset.model, current_position),
+                self.ordering, reverse
+            ))
+
+        # One extra row tells whether a page follows this one.
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+
+        has_current = current_position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = (
+                has_current, following_position is not None
+            )
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next, self.has_previous = (
+                following_position is not None, has_current
+            )
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            name = order.lstrip('-')
+            if isinstance(instance, dict):
+                values.append(instance[name])
+            else:
+                values.append(getattr(instance, name))
+        return json.dumps([str(value) for value in values])
+
+    def parse_position(self, model, position):
+        """Values of the ordering fields stored in a cursor position."""
+        try:
+            values = json.loads(position)
+            if (not isinstance(values, list)
+                    or len(values) != len(self.ordering)):
+                raise ValueError
+            return [
+                model._meta.get_field(order.lstrip('-')).to_python(value)
+                for order, value in zip(self.ordering, values)
+            ]
+        except (ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+
+class RecipeCursorPagination(CustomCursorPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPagination(CustomCursorPagination):
+    ordering = ('id', )
+
+
+class SwitchablePaginationMixin:
+    """
+    Lets clients choose keyset pagination with ?pagination=cursor.
+
+    Page-number pagination stays the default; links of cursor pages keep
+    the mode parameter, any request with ?cursor= is cursor-paginated.
+    Parameters in page_number_only_query_params (e.g. a search that
+    orders by rank instead of the cursor ordering) force page numbers.
+    """
+    cursor_pagination_class = None
+    pagination_mode_query_param = 'pagination'
+    page_number_only_query_params = ()
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_cursor_pagination():
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
+
+    def use_cursor_pagination(self):
+        if self.cursor_pagination_class is None:
+            return False
+        params = self.request.query_params
+        if any(map(params.get, self.page_number_only_query_params)):
+            return False
+        return (
+            params.get(self.pagination_mode_query_param) == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param in params
+        )
+
+
+class FeedPagination(BasePagination):
+    """
+    Keyset pagination of the feed by an explicit (pub_date, recipe id).
+
+    The view reads limit + 1 entries after the decoded position and
+    passes the last shown one to get_paginated_response.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+    request = None
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        self.request = request
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            pub_date, pk = (
+                urlsafe_b64decode(encoded.encode()).decode().split('|')
+            )
+            position = parse_datetime(pub_date), int(pk)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        pub_date, pk = position
+        encoded = urlsafe_b64encode(
+            f'{pub_date.isoformat()}|{pk}'.encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            encoded
+        )
+
+    def get_paginated_response(self, data, next_position=None):
+        return Response(OrderedDict([
+            ('next', next_position and self.encode_cursor(next_position)),
+            ('results', data),
+        ]))
@@ -1,3 +1,6 @@
+from secrets import compare_digest
+
+from django.conf import settings
 from rest_framework.permissions import SAFE_METHODS, BasePermission
 
 
@@ -36,3 +39,13 @@ class ReadOnly(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         return self.has_permission(request, view)
+
+
+class HasMetricsToken(BasePermission):
+    """Allows access with "Authorization: Bearer <METRICS['TOKEN']>"."""
+
+    def has_permission(self, request, view):
+        token = settings.METRICS['TOKEN']
+        return bool(token) and compare_digest(
+            request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+        )
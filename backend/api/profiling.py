@@ -0,0 +1,75 @@
+"""
+Profilers for single requests (api.middleware.ProfilingMiddleware).
+
+CProfiler is deterministic and produces a .prof file for pstats or
+snakeviz. StackSampler samples the stack of the request thread and
+produces collapsed stacks ("a;b;c 12" lines) for flamegraph.pl or
+speedscope.
+"""
+import cProfile
+import marshal
+import sys
+import threading
+from collections import Counter
+
+
+class CProfiler:
+    format = 'prof'
+
+    def __init__(self, **options):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def result(self) -> bytes:
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+class StackSampler:
+    format = 'collapsed'
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name='profiler', daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f'{code.co_name} ({code.co_filename}:'
+                    f'{code.co_firstlineno})'
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def result(self) -> bytes:
+        return '\n'.join(
+            f'{stack} {count}' for stack, count in self.stacks.items()
+        ).encode()
+
+
+PROFILERS = {
+    CProfiler.format: CProfiler,
+    StackSampler.format: StackSampler,
+}
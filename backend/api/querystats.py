@@ -0,0 +1,174 @@
+"""
+SQL query statistics by fingerprint.
+
+A fingerprint is the query text with literals, placeholder lists and
+savepoint names replaced, so "WHERE id IN (%s, %s)" and "WHERE id IN
+(%s)" are one query. The middleware (api.middleware.QueryStatsMiddleware)
+hands every query of a sampled request to the process-wide observer,
+which aggregates count, total, max and a latency histogram per view and
+fingerprint. Every QUERY_STATS['FLUSH_INTERVAL'] seconds a background
+thread of the process adds the aggregates to QueryFingerprint rows, so
+no request waits for it; p95 comes from the merged histogram. The first
+SELECT of a fingerprint slower than QUERY_STATS['SLOW_MS'] is run again
+under EXPLAIN and the plan is stored with the row.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .models import QueryFingerprint
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+              2500, 5000, 10000)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+SAVEPOINT = re.compile(r'(SAVEPOINT) "?\w+"?')
+PLACEHOLDERS = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+UNION_ROWS = re.compile(
+    r'(?: UNION ALL SELECT (?:%s|\?)(?:, (?:%s|\?))*){2,}'
+)
+SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """Returns (normalized sql, md5 of it)."""
+    normalized = STRING.sub('?', sql)
+    normalized = SAVEPOINT.sub(r'\1 ?', normalized)
+    normalized = NUMBER.sub('?', normalized)
+    normalized = PLACEHOLDERS.sub('(...)', normalized)
+    normalized = ROWS.sub('(...)', normalized)
+    normalized = UNION_ROWS.sub(' UNION ALL SELECT ...', normalized)
+    normalized = SPACES.sub(' ', normalized).strip()
+    return normalized, hashlib.md5(normalized.encode()).hexdigest()
+
+
+def percentile(buckets, max_ms, share=0.95):
+    """Upper bound of the bucket holding the given share of queries."""
+    total = sum(buckets)
+    if not total:
+        return 0.0
+    seen = 0
+    for bound, count in zip(BUCKETS_MS, buckets):
+        seen += count
+        if seen >= total * share:
+            return min(float(bound), max_ms)
+    return max_ms
+
+
+def explain(alias, sql, params):
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+    return '\n'.join(' '.join(map(str, row)) for row in rows)
+
+
+class QueryObserver:
+    """Per-process aggregates waiting to be flushed to the database."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flusher_pid = None
+
+    @property
+    def config(self):
+        return settings.QUERY_STATS
+
+    def record(self, view, queries):
+        self.start_flusher()
+        slow_ms = self.config['SLOW_MS']
+        with self.lock:
+            for query in queries:
+                duration = query['time_ms']
+                normalized, digest = fingerprint(query['sql'])
+                stats = self.pending.get((view, digest))
+                if stats is None:
+                    stats = self.pending[(view, digest)] = {
+                        'sql': normalized, 'count': 0, 'total': 0.0,
+                        'max': 0.0, 'buckets': [0] * (len(BUCKETS_MS) + 1),
+                        'slow': None,
+                    }
+                stats['count'] += 1
+                stats['total'] += duration
+                stats['max'] = max(stats['max'], duration)
+                stats['buckets'][bisect_left(BUCKETS_MS, duration)] += 1
+                if (duration >= slow_ms and stats['slow'] is None
+                        and not query['many']
+                        and normalized.upper().startswith('SELECT')):
+                    stats['slow'] = (
+                        query['database'], query['sql'], query['params']
+                    )
+
+    def start_flusher(self):
+        """Starts the flushing thread of this process once (after fork too)."""
+        if self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+            threading.Thread(
+                target=self.run_flusher, name='querystats', daemon=True
+            ).start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.config['FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Query stats flush failed')
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        explain_after = timezone.now() - timedelta(
+            seconds=self.config['EXPLAIN_TTL']
+        )
+        for (view, digest), stats in pending.items():
+            with transaction.atomic():
+                row, _ = (
+                    QueryFingerprint.objects.select_for_update()
+                    .get_or_create(view=view, fingerprint=digest,
+                                   defaults={'sql': stats['sql']})
+                )
+                buckets = row.buckets or [0] * len(stats['buckets'])
+                row.buckets = [
+                    old + new for old, new in zip(buckets, stats['buckets'])
+                ]
+                row.count += stats['count']
+                row.total_ms += stats['total']
+                row.max_ms = max(row.max_ms, stats['max'])
+                row.p95_ms = percentile(row.buckets, row.max_ms)
+                if stats['slow'] is not None and (
+                    row.explained_at is None
+                    or row.explained_at < explain_after
+                ):
+                    row.explain = explain(*stats['slow'])
+                    row.explained_at = timezone.now()
+                row.save()
+
+
+observer = QueryObserver()
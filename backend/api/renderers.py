@@ -0,0 +1,38 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class FileRenderer(BaseRenderer):
+    """
+    Renderer for file downloads selected by ?format=.
+
+    File content is returned as a ready HttpResponse; the renderer itself
+    only serializes error payloads (authentication errors and the like).
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, bytes):
+            return data
+        # Error payloads are JSON in utf-8 even for binary formats
+        # (PDFRenderer has no charset).
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class PDFRenderer(FileRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+class CSVRenderer(FileRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PlainTextRenderer(FileRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
@@ -1,14 +1,19 @@
 from django.contrib.auth import get_user_model
-from drf_extra_fields.fields import Base64ImageField
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.validators import ValidationError
 
 from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
 
+from .fields import CappedBase64ImageField, ImageVariantsField
+from .instrumentation import TimedSerializerMixin
+from .utils import same_file_content
+
 User = get_user_model()
 
 
-class UserCreateSerializer(serializers.ModelSerializer):
+class UserCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор создания пользователя."""
     class Meta:
         model = User
@@ -24,7 +29,36 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return user
 
 
-class ExtUserSerializer(serializers.ModelSerializer):
+class BulkIdsSerializer(serializers.Serializer):
+    """Сериализатор списка id для пакетных операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+
+
+class UserListSerializer(serializers.ListSerializer):
+    """Список пользователей с подписками текущего пользователя.
+
+    Id авторов, на которых подписан запрашивающий, загружаются одним
+    запросом на весь список, дальше is_subscribed - поиск по множеству.
+    """
+    subscribed_ids = None
+
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, 'all') else data)
+        current_user = self.context.get('request').user
+        if current_user.is_authenticated:
+            self.subscribed_ids = set(
+                current_user.follows
+                .filter(author__in=[user.id for user in users])
+                .values_list('author_id', flat=True)
+            )
+        return super().to_representation(users)
+
+
+class ExtUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор отображения пользователя."""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -32,22 +66,28 @@ class ExtUserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed')
+        list_serializer_class = UserListSerializer
 
     def get_is_subscribed(self, obj):
         current_user = self.context.get('request').user
         if not current_user.is_authenticated:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        subscribed_ids = getattr(self.parent, 'subscribed_ids', None)
+        if subscribed_ids is not None:
+            return obj.id in subscribed_ids
         return current_user.follows.filter(author=obj).exists()
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор тегов."""
     class Meta:
         model = Tag
         fields = '__all__'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор ингредиентов."""
     class Meta:
         model = Ingredient
@@ -66,7 +106,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор рецепта."""
     author = ExtUserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
@@ -75,20 +115,26 @@ class RecipeSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.BooleanField(default=False)
     is_in_shopping_cart = serializers.BooleanField(default=False)
-    image = Base64ImageField()
+    image = CappedBase64ImageField()
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
+                  'is_in_shopping_cart', 'name', 'image', 'images', 'text',
                   'cooking_time')
         read_only_fields = ('id', 'author', 'is_favorited',
                             'is_in_shopping_cart', )
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
 
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор добавления ингредиента к рецепту."""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = RecipeIngredient
@@ -106,15 +152,17 @@ class AddIngredientSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
+class RecipeCreateUpdateSerializer(TimedSerializerMixin,
+                                   serializers.ModelSerializer):
     """Сериализатор создания и редактирования рецепта."""
     ingredients = AddIngredientSerializer(
         many=True, write_only=True, required=True
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all(), required=True
+    tags = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        write_only=True, required=True
     )
-    image = Base64ImageField()
+    image = CappedBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -123,6 +171,15 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                'recipe_ingredients',
+                RecipeIngredient.objects.select_related('ingredient')
+            ),
+            'tags',
+            'image_variants'
+        )
         ingredients_amount = RecipeIngredientSerializer(
             instance.recipe_ingredients.all(), many=True
         )
@@ -131,6 +188,7 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         ret['id'] = instance.id
         ret['ingredients'] = ingredients_amount.data
         ret['tags'] = tags.data
+        ret['images'] = ImageVariantsField().to_representation(instance)
         ret['author'] = ExtUserSerializer(
             instance.author,
             context={'request': super().context['request']}
@@ -139,32 +197,60 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         ret['is_in_shopping_cart'] = False
         return ret
 
+    def validate_ingredients(self, value):
+        """Загружает все ингредиенты рецепта одним запросом."""
+        ids = [ingredient['id'] for ingredient in value]
+        if len(set(ids)) != len(ids):
+            raise ValidationError('Ингредиенты дублируются!')
+        found = Ingredient.objects.in_bulk(ids)
+        missing = [str(pk) for pk in ids if pk not in found]
+        if missing:
+            raise ValidationError(
+                f'Ингредиенты не найдены: {", ".join(missing)}.'
+            )
+        for ingredient in value:
+            ingredient['id'] = found[ingredient['id']]
+        return value
+
+    def validate_tags(self, value):
+        """Загружает все теги рецепта одним запросом."""
+        ids = list(dict.fromkeys(value))
+        found = Tag.objects.in_bulk(ids)
+        missing = [str(pk) for pk in ids if pk not in found]
+        if missing:
+            raise ValidationError(f'Теги не найдены: {", ".join(missing)}.')
+        return [found[pk] for pk in ids]
+
+    @transaction.atomic(savepoint=False)
     def create(self, validated_data):
+        """
+        Рецепт, его теги и ингредиенты в одной транзакции.
+
+        Пять записей: ссылка на файл картинки, рецепт, счётчик рецептов
+        автора, теги и ингредиенты; вместе с поиском ингредиентов и тегов
+        при валидации - 7 запросов при любом числе ингредиентов.
+        """
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
-        list_to_create, list_to_check = [], []
-        for ingredient in ingredients:
-            list_to_check.append(ingredient.get('id'))
-            list_to_create.append(
-                RecipeIngredient(
-                    recipe=recipe,
-                    ingredient=ingredient.get('id'),
-                    amount=ingredient.get('amount')
-                )
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=recipe, tag=tag) for tag in tags
+        ])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredient.get('id'),
+                amount=ingredient.get('amount')
             )
-        if len(set(list_to_check)) != len(ingredients):
-            recipe.delete()
-            raise ValidationError(
-                detail={'ingredients': 'Ингредиенты дублируются!'}
-            )
-        RecipeIngredient.objects.bulk_create(list_to_create)
+            for ingredient in ingredients
+        ])
         return recipe
 
     def validate(self, attrs):
         errors = {}
-        for field in self.Meta.fields:
+        # При PATCH проверяются только переданные поля.
+        fields = attrs if self.partial else self.Meta.fields
+        for field in fields:
             if field not in attrs:
                 errors[field] = f'Необходимо заполнить поле {field}.'
             elif not attrs.get(field):
@@ -173,41 +259,69 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             raise ValidationError(errors)
         return attrs
 
+    @staticmethod
+    def update_ingredients(instance, ingredients):
+        """Применяет к рецепту только разницу в ингредиентах."""
+        amounts = {
+            ingredient.get('id').id: ingredient.get('amount')
+            for ingredient in ingredients
+        }
+        current = {
+            item.ingredient_id: item
+            for item in instance.recipe_ingredients.all()
+        }
+        list_to_create, list_to_update = [], []
+        for ingredient_id, amount in amounts.items():
+            item = current.pop(ingredient_id, None)
+            if item is None:
+                list_to_create.append(RecipeIngredient(
+                    recipe=instance, ingredient_id=ingredient_id, amount=amount
+                ))
+            elif item.amount != amount:
+                item.amount = amount
+                list_to_update.append(item)
+        if current:
+            RecipeIngredient.objects.filter(
+                pk__in=[item.pk for item in current.values()]
+            ).delete()
+        if list_to_update:
+            RecipeIngredient.objects.bulk_update(list_to_update, ['amount'])
+        if list_to_create:
+            RecipeIngredient.objects.bulk_create(list_to_create)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = instance.recipe_ingredients.all()
-        new_ingredients = validated_data.pop('ingredients')
-        list_to_create, list_to_check = [], []
-        for ingredient in new_ingredients:
-            list_to_check.append(ingredient.get('id'))
-            list_to_create.append(
-                RecipeIngredient(
-                    recipe=instance,
-                    ingredient=ingredient.get('id'),
-                    amount=ingredient.get('amount')
-                )
-            )
-        if len(set(list_to_check)) != len(ingredients):
-            raise ValidationError(
-                detail={'ingredients': 'Ингредиенты дублируются!'}
-            )
-        ingredients.delete()
-        RecipeIngredient.objects.bulk_create(list_to_create)
-
-        instance.tags.set(validated_data.pop('tags'))
-        instance.image.delete(save=False)
-        instance.image = validated_data.pop('image')
-        instance.name = validated_data.pop('name')
-        instance.text = validated_data.pop('text')
-        instance.cooking_time = validated_data.pop('cooking_time')
-        instance.save()
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            # set() сам добавляет и удаляет только отличающиеся теги.
+            instance.tags.set(tags)
+        image = validated_data.pop('image', None)
+        if image is not None and not same_file_content(instance.image, image):
+            old_image = instance.image.name
+            storage = instance.image.storage
+            validated_data['image'] = image
+            transaction.on_commit(lambda: storage.delete(old_image))
+        update_fields = [
+            field for field, value in validated_data.items()
+            if getattr(instance, field) != value
+        ]
+        for field in update_fields:
+            setattr(instance, field, validated_data[field])
+        if update_fields:
+            instance.save(update_fields=update_fields)
         return instance
 
 
-class ShortRecipes(serializers.ModelSerializer):
+class ShortRecipes(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор короткого отображения рецепта."""
+    images = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class UserWithRecipes(ExtUserSerializer):
@@ -220,8 +334,13 @@ class UserWithRecipes(ExtUserSerializer):
 
     def get_recipes(self, obj):
         request = self.context["request"]
-        lim = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()[:int(lim)] if lim else obj.recipes.all()
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            lim = request.query_params.get('recipes_limit')
+            recipes = obj.recipes.prefetch_related('image_variants')
+            if lim:
+                recipes = recipes[:int(lim)]
         return ShortRecipes(
             recipes, many=True, context={"request": request}
         ).data
@@ -0,0 +1,64 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes import feed, images, search
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import Follow
+
+from .cache import bump_catalogue_version
+from .indexes import ingredient_index
+from .jobs import get_job_backend
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    # Many recipes may use the ingredient: they are reindexed by a job,
+    # not inside the request.
+    if not created:
+        transaction.on_commit(lambda: get_job_backend().submit(
+            search.reindex_ingredient, instance.pk
+        ))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def catalogue_changed(sender, **kwargs):
+    bump_catalogue_version()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            lambda: get_job_backend().submit(feed.fan_out, instance.pk)
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is None or 'image' in update_fields:
+        transaction.on_commit(lambda: get_job_backend().submit(
+            images.render_variants, instance.pk
+        ))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: get_job_backend().submit(
+            feed.backfill, instance.follower_id, instance.author_id
+        ))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    feed.drop(instance.follower_id, instance.author_id)
@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+
+User = get_user_model()
+
+
+class RecipeQueryCountTests(APITestCase):
+    """The recipe list and detail run a fixed number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass',
+            first_name='Reader', last_name='Reader'
+        )
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color='#000000',
+                               slug=f'tag-{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        for number in range(12):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com', password='pass',
+                first_name='Author', last_name='Author'
+            )
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                image='recipes/test.png', cooking_time=10
+            )
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in ingredients
+            )
+        cls.recipe = recipe
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_list_does_not_depend_on_page_size(self):
+        # COUNT, recipes with authors and flags, tags, ingredients,
+        # image variants.
+        for limit in (2, 10):
+            with self.subTest(limit=limit), self.assertNumQueries(5):
+                response = self.client.get(
+                    reverse('recipes-list'), {'limit': limit}
+                )
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_retrieve(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                reverse('recipes-detail', args=[self.recipe.pk])
+            )
+        self.assertEqual(len(response.data['ingredients']), 5)
+
+
+class RecipeCursorPaginationTests(APITestCase):
+    """Cursor pages neither skip nor repeat recipes published together."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Author', last_name='Author'
+        )
+        for number in range(5):
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                image='recipes/test.png', cooking_time=10
+            )
+        Recipe.objects.update(pub_date=timezone.now())
+        cls.ids = list(
+            Recipe.objects.order_by('-id').values_list('id', flat=True)
+        )
+
+    def walk(self, url, params, link):
+        pages = []
+        while url:
+            response = self.client.get(url, params)
+            params = None
+            pages.append([recipe['id'] for recipe in response.data['results']])
+            url = response.data[link]
+        return pages, response
+
+    def test_pages_with_equal_pub_date(self):
+        pages, last = self.walk(
+            reverse('recipes-list'), {'pagination': 'cursor', 'limit': 2},
+            'next'
+        )
+        self.assertEqual(sum(pages, []), self.ids)
+        pages, _ = self.walk(last.data['previous'], None, 'previous')
+        self.assertEqual(sum(reversed(pages), []), self.ids[:-1])
+
+    def test_search_uses_page_numbers(self):
+        response = self.client.get(
+            reverse('recipes-list'), {'pagination': 'cursor', 'search': 'x'}
+        )
+        self.assertIn('count', response.data)
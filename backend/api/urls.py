@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import FollowViewSet, IngredientViewSet, RecipeViewSet, TagViewSet
+from .views import (FollowViewSet, IngredientViewSet, MetricsView,
+                    RecipeViewSet, TagViewSet)
 
 router = DefaultRouter()
 router.register(r'users', FollowViewSet, basename='follows')
@@ -10,6 +11,7 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 
 urlpatterns = [
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,19 +1,42 @@
+import csv
+import hashlib
 import io
+import os
+import time
 from datetime import date
+from functools import lru_cache
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen.canvas import Canvas
 
+from recipes.models import RecipeIngredient
+from recipes.storage import content_digest
+
+from .metrics import metrics
+
+FONT = 'Bonche-Light'
+FONT_PATH = os.path.join(settings.BASE_DIR, f'{FONT}.ttf')
+
+
+@lru_cache(maxsize=None)
+def register_font():
+    """Registers the TTF font once per process."""
+    pdfmetrics.registerFont(TTFont(FONT, FONT_PATH, 'UTF-8'))
+
 
 def gen_pdf(list_of_strings) -> io.BytesIO:
+    register_font()
     buffer = io.BytesIO()
     p = Canvas(buffer, pagesize=letter)
-    font = 'Bonche-Light'
-    pdfmetrics.registerFont(TTFont(font, f'{font}.ttf', 'UTF-8'))
+    font = FONT
     width, height = letter
-    x, y = 250, height - 75  # start point
+    top, bottom = height - 75, 50
+    x, y = 250, top  # start point
 
     # header:
     p.setFont(font, 20)
@@ -24,12 +47,19 @@ def gen_pdf(list_of_strings) -> io.BytesIO:
     # body
     p.setFont(font, 14)
     for elem in list_of_strings:
+        if y < bottom:
+            p.showPage()
+            p.setFont(font, 14)
+            y = top
         p.drawString(x, y, elem)
         y -= 20
 
     # bottom
     x = 255
     y -= 50
+    if y < bottom:
+        p.showPage()
+        y = top
     p.setFont(font, 10)
     p.drawString(x, y, f'© FoodGram {date.today().year}')
 
@@ -37,3 +67,84 @@ def gen_pdf(list_of_strings) -> io.BytesIO:
     p.save()
     buffer.seek(0)
     return buffer
+
+
+def shoplist_pdf_key(list_of_strings):
+    digest = hashlib.sha256()
+    digest.update(str(date.today().year).encode())
+    for elem in list_of_strings:
+        digest.update(b'\n')
+        digest.update(elem.encode())
+    return f'shoplist_pdf:{digest.hexdigest()}'
+
+
+def get_shoplist_pdf(list_of_strings) -> bytes:
+    """PDF for the lines, rendered once per distinct content."""
+    key = shoplist_pdf_key(list_of_strings)
+    pdf = cache.get(key)
+    metrics.inc('foodgram_cache_requests_total', (
+        ('cache', 'shoplist_pdf'),
+        ('result', 'miss' if pdf is None else 'hit'),
+    ))
+    if pdf is None:
+        start = time.perf_counter()
+        pdf = gen_pdf(list_of_strings).getvalue()
+        metrics.observe(
+            'foodgram_shoplist_pdf_render_seconds',
+            time.perf_counter() - start
+        )
+        cache.set(key, pdf, settings.SHOPLIST_PDF_CACHE_TIMEOUT)
+    return pdf
+
+
+class Echo:
+    """File-like object that returns written value instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def shoplist_rows(user):
+    """(name, measurement unit, total amount) of the user's cart."""
+    shop_recipes_ids = user.shoprecipes.all().values('recipe')
+    return (
+        RecipeIngredient.objects
+        .filter(recipe_id__in=shop_recipes_ids)
+        .values('ingredient__name', 'ingredient__measurement_unit')
+        .annotate(total=Sum('amount'))
+        .order_by('ingredient__name')
+        .values_list(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'total'
+        )
+    )
+
+
+def shoplist_line(name, measurement_unit, amount):
+    return f'{name.capitalize()} ({measurement_unit}) — {amount}'
+
+
+def iter_text(rows):
+    for row in rows:
+        yield shoplist_line(*row) + '\n'
+
+
+def same_file_content(stored, uploaded) -> bool:
+    """Checks whether an uploaded file repeats the stored one."""
+    if not stored:
+        return False
+    try:
+        if stored.size != uploaded.size:
+            return False
+        with stored.open('rb'):
+            return content_digest(stored) == content_digest(uploaded)
+    except OSError:
+        return False
@@ -1,61 +1,135 @@
 import datetime
+import io
+from functools import partial
+from urllib.parse import quote
 
 from django.contrib.auth import get_user_model
-from django.db.models import BooleanField, Count, ExpressionWrapper, Q, Sum
-from django.http import FileResponse
+from django.db import transaction
+from django.db.models import (Exists, OuterRef, Prefetch,
+                              prefetch_related_objects)
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
+from django.urls import reverse
 from django_filters import rest_framework as filters
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
+from recipes import feed
+from recipes.feed import read_feed
 from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
                             RecipeIngredient, ShopRecipe, Tag)
+from recipes.search import update_search_index
+from recipes.signals import recount
+from users.models import Follow
 
+from .cache import CatalogueCacheMixin
 from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import CustomPageNumberPagination
-from .permissions import IsAdmin, IsAuthor, ReadOnly
-from .serializers import (IngredientSerializer, RecipeCreateUpdateSerializer,
-                          RecipeSerializer, ShortRecipes, TagSerializer,
-                          UserWithRecipes)
-from .utils import gen_pdf
+from .jobs import (DONE, FAILED, SHOPLIST_FORMATS, get_job_backend,
+                   shoplist_jobs)
+from .metrics import metrics
+from .pagination import (CustomPageNumberPagination, FeedPagination,
+                         RecipeCursorPagination, SubscriptionCursorPagination,
+                         SwitchablePaginationMixin)
+from .permissions import HasMetricsToken, IsAdmin, IsAuthor, ReadOnly
+from .renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
+from .serializers import (BulkIdsSerializer, IngredientSerializer,
+                          RecipeCreateUpdateSerializer, RecipeSerializer,
+                          ShortRecipes, TagSerializer, UserWithRecipes)
+from .utils import (get_shoplist_pdf, iter_csv, iter_text, shoplist_line,
+                    shoplist_rows)
 
 User = get_user_model()
 
 
-class RecipeViewSet(ModelViewSet):
+USER_RECIPES_COUNTERS = {
+    FavoriteRecipe: 'favorites_count',
+    ShopRecipe: 'in_carts_count',
+}
+
+
+def bulk_results(ids, statuses, found):
+    """Per-id result of a batch operation, in the order of the request."""
+    results = []
+    for pk in ids:
+        item_status = 'not_found' if pk not in found else 'not_in_list'
+        for name, pks in statuses.items():
+            if pk in pks:
+                item_status = name
+                break
+        results.append({'id': pk, 'status': item_status})
+    return results
+
+
+class RecipeViewSet(SwitchablePaginationMixin, ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
+    cursor_pagination_class = RecipeCursorPagination
+    # Search results are ordered by rank, which the cursor cannot follow.
+    page_number_only_query_params = ('search', )
     permission_classes = [IsAdmin | IsAuthor | ReadOnly]
     filterset_class = RecipeFilter
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_fields = ('tags', )
 
     def get_queryset(self):
-        recipes = Recipe.objects.all()
+        """
+        Recipes with everything RecipeSerializer needs.
+
+        List and retrieve run a fixed number of queries regardless of the
+        page size: the recipes joined with their authors (favorite, cart
+        and subscription flags are EXISTS subqueries of the same SELECT),
+        one prefetch each for tags, image variants and ingredients. The
+        paginated list adds a COUNT query on top.
+        """
+        recipes = (
+            Recipe.objects
+            .defer('search_vector')
+            .select_related('author')
+            .prefetch_related(
+                'tags',
+                'image_variants',
+                Prefetch(
+                    'recipe_ingredients',
+                    queryset=RecipeIngredient.objects.select_related(
+                        'ingredient'
+                    )
+                )
+            )
+        )
         user = self.request.user
 
         if user.is_authenticated:
             recipes = recipes.annotate(
-                is_favorited=ExpressionWrapper(
-                    Q(id__in=user.favoriterecipes.all().values('recipe')),
-                    output_field=BooleanField()
-                ),
-                is_in_shopping_cart=ExpressionWrapper(
-                    Q(id__in=user.shoprecipes.all().values('recipe')),
-                    output_field=BooleanField()
-                )
+                is_favorited=Exists(FavoriteRecipe.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+                is_in_shopping_cart=Exists(ShopRecipe.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+                author_is_subscribed=Exists(Follow.objects.filter(
+                    follower=user, author=OuterRef('author')
+                ))
             )
         return recipes
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        transaction.on_commit(lambda: update_search_index([recipe.pk]))
+
+    def perform_update(self, serializer):
+        recipe = serializer.save()
+        transaction.on_commit(lambda: update_search_index([recipe.pk]))
 
     def get_serializer_class(self):
-        if self.request.method in ('POST', 'PATCH', ):
+        if self.request.method in ('POST', 'PUT', 'PATCH'):
             return RecipeCreateUpdateSerializer
         return RecipeSerializer
 
@@ -69,7 +143,9 @@ class RecipeViewSet(ModelViewSet):
                     {'errors': 'Рецепт уже в списке.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            model.objects.create(recipe=recipe, user=request.user)
+            with transaction.atomic():
+                model.objects.create(recipe=recipe, user=request.user)
+            prefetch_related_objects([recipe], 'image_variants')
             serializer = ShortRecipes(recipe, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if not is_exists:
@@ -81,6 +157,56 @@ class RecipeViewSet(ModelViewSet):
         user_recipes.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _bulk_user_recipes_controller(self, request, model):
+        """
+        Adds (POST) or removes (DELETE) a list of recipes in one statement.
+
+        Returns a status for every requested id.
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        user = request.user
+        counter = USER_RECIPES_COUNTERS[model]
+        in_list = set(
+            model.objects.filter(user=user, recipe_id__in=ids)
+            .values_list('recipe_id', flat=True)
+        )
+        found = set(
+            Recipe.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = found - in_list
+                model.objects.bulk_create(
+                    [model(user=user, recipe_id=pk) for pk in changed],
+                    ignore_conflicts=True
+                )
+                # bulk_create sends no signals and does not report rows
+                # skipped as conflicts: counters are recounted from the
+                # rows that are actually there.
+                recount(Recipe, changed, counter, model, 'recipe')
+                statuses = {'created': changed, 'exists': in_list}
+            else:
+                # One DELETE without the per-row post_delete signals, the
+                # counters are recounted like after bulk_create.
+                rows = model.objects.filter(user=user, recipe_id__in=in_list)
+                rows._raw_delete(rows.db)
+                recount(Recipe, in_list, counter, model, 'recipe')
+                statuses = {'deleted': in_list}
+        return Response({'results': bulk_results(ids, statuses, found)})
+
+    @action(methods=['POST', 'DELETE'], detail=False, url_path='favorite',
+            url_name='favorite-bulk', permission_classes=[IsAuthenticated])
+    def favorite_bulk(self, request):
+        return self._bulk_user_recipes_controller(request, FavoriteRecipe)
+
+    @action(methods=['POST', 'DELETE'], detail=False,
+            url_path='shopping_cart', url_name='shopping-cart-bulk',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_bulk(self, request):
+        return self._bulk_user_recipes_controller(request, ShopRecipe)
+
     @action(methods=['POST', 'DELETE'], detail=True,
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk):
@@ -92,44 +218,168 @@ class RecipeViewSet(ModelViewSet):
         return self._user_recipes_controller(request, pk, ShopRecipe)
 
     @action(methods=['GET'], detail=False,
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[JSONRenderer, PDFRenderer, CSVRenderer,
+                              PlainTextRenderer])
     def download_shopping_cart(self, request):
-        shop_recipes_ids = request.user.shoprecipes.all().values('recipe')
-        ingredients = (
-            RecipeIngredient.objects
-            .filter(recipe_id__in=shop_recipes_ids)
-            .select_related('ingredient')
-            .values('ingredient__name')
-            .annotate(total=Sum('amount'))
-            .values(
-                'ingredient__name',
-                'total',
-                'ingredient__measurement_unit'
+        """Shopping list as ?format=pdf (default), csv or txt."""
+        file_format = request.query_params.get('format', PDFRenderer.format)
+        if file_format not in SHOPLIST_FORMATS:
+            return Response(
+                {'format': f'Допустимые форматы: {SHOPLIST_FORMATS}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        filename = (
+            f'{request.user} shoplist {datetime.date.today()}.{file_format}'
+        )
+        rows = shoplist_rows(request.user).iterator()
+        if file_format == PDFRenderer.format:
+            return FileResponse(
+                io.BytesIO(get_shoplist_pdf(
+                    [shoplist_line(*row) for row in rows]
+                )),
+                as_attachment=True,
+                filename=filename
             )
+        if file_format == CSVRenderer.format:
+            content, content_type = iter_csv(rows), CSVRenderer.media_type
+        else:
+            content = iter_text(rows)
+            content_type = PlainTextRenderer.media_type
+        response = StreamingHttpResponse(
+            content, content_type=f'{content_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = (
+            f"attachment; filename*=utf-8''{quote(filename)}"
         )
+        return response
 
-        ingredients_list = []
-        for ingredient in ingredients:
-            ingredients_list.append(
-                f'{ingredient.get("ingredient__name").capitalize()} '
-                f'({ingredient.get("ingredient__measurement_unit")}) — '
-                f'{ingredient.get("total")}'
+    @action(methods=['GET'], detail=False,
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """New recipes of the authors the user follows, newest first."""
+        paginator = FeedPagination()
+        position = paginator.decode_cursor(request)
+        limit = paginator.get_page_size(request)
+        entries = read_feed(request.user, position, limit + 1)
+        page = entries[:limit]
+        recipes = self.get_queryset().in_bulk([pk for _, pk in page])
+        serializer = self.get_serializer(
+            [recipes[pk] for _, pk in page if pk in recipes], many=True
+        )
+        return paginator.get_paginated_response(
+            serializer.data, page[-1] if len(entries) > limit else None
+        )
+
+    @action(methods=['POST'], detail=False,
+            url_path='download_shopping_cart/jobs',
+            permission_classes=[IsAuthenticated])
+    def download_shopping_cart_jobs(self, request):
+        """Queues rendering of the shopping list, returns the job."""
+        file_format = request.data.get('format', 'pdf')
+        if file_format not in SHOPLIST_FORMATS:
+            return Response(
+                {'format': f'Допустимые форматы: {SHOPLIST_FORMATS}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        job = shoplist_jobs.create(request.user, file_format)
+        return Response(
+            self._job_representation(request, job),
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(methods=['GET'], detail=False,
+            url_path=r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f]{32})',
+            permission_classes=[IsAuthenticated])
+    def download_shopping_cart_job(self, request, job_id):
+        job = shoplist_jobs.get(job_id, request.user)
+        if job is None:
+            raise Http404
+        return Response(self._job_representation(request, job))
+
+    @action(methods=['GET'], detail=False,
+            url_path=(
+                r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f]{32})/result'
+            ),
+            permission_classes=[IsAuthenticated])
+    def download_shopping_cart_job_result(self, request, job_id):
+        job = shoplist_jobs.get(job_id, request.user)
+        if job is None:
+            raise Http404
+        if job['status'] == FAILED:
+            return Response(
+                self._job_representation(request, job),
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        if job['status'] != DONE:
+            return Response(
+                {'errors': 'Файл ещё не готов.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        try:
+            result = open(shoplist_jobs.result_path(job), 'rb')
+        except FileNotFoundError:
+            # Purged after the status check.
+            return Response(
+                {'errors': 'Файл удалён, создайте задание заново.'},
+                status=status.HTTP_410_GONE
             )
         return FileResponse(
-            gen_pdf(ingredients_list),
-            as_attachment=True,
-            filename=f'{request.user} shoplist {datetime.date.today()}.pdf'
+            result, as_attachment=True, filename=job['filename']
         )
 
+    @action(methods=['POST'], detail=False,
+            url_path=(
+                r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f]{32})/retry'
+            ),
+            permission_classes=[IsAuthenticated])
+    def download_shopping_cart_job_retry(self, request, job_id):
+        """Queues a failed job again."""
+        job = shoplist_jobs.get(job_id, request.user)
+        if job is None:
+            raise Http404
+        if job['status'] != FAILED:
+            return Response(
+                {'errors': 'Повторить можно только неудавшееся задание.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        if not shoplist_jobs.retry(job):
+            job = shoplist_jobs.get(job_id, request.user) or job
+        return Response(
+            self._job_representation(request, job),
+            status=status.HTTP_202_ACCEPTED
+        )
 
-class TagViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
+    @staticmethod
+    def _job_representation(request, job):
+        status_url = request.build_absolute_uri(reverse(
+            'recipes-download-shopping-cart-job', args=(job['id'],)
+        ))
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'progress': job['progress'],
+            'format': job['format'],
+            'status_url': status_url,
+            'result_url': f'{status_url}result/' if job['status'] == DONE
+            else None,
+            'error': 'Не удалось сформировать список покупок.'
+            if job['status'] == FAILED else None,
+            'retry_url': f'{status_url}retry/' if job['status'] == FAILED
+            else None,
+        }
+
+
+class TagViewSet(CatalogueCacheMixin, ListModelMixin, RetrieveModelMixin,
+                 GenericViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
     pagination_class = None
 
 
-class IngredientViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
+class IngredientViewSet(CatalogueCacheMixin, ListModelMixin,
+                        RetrieveModelMixin, GenericViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
@@ -138,24 +388,78 @@ class IngredientViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     search_fields = ('^name', )
 
 
-class FollowViewSet(GenericViewSet):
+class FollowViewSet(SwitchablePaginationMixin, GenericViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = CustomPageNumberPagination
+    cursor_pagination_class = SubscriptionCursorPagination
 
     @action(methods=['GET'], detail=False)
     def subscriptions(self, request):
         current_user = request.user
         followings = current_user.follows.values('author')
-        followings_users = (
-            User.objects.filter(id__in=followings)
-                .annotate(recipes_count=Count('recipes__id'))
-        )
+        followings_users = User.objects.filter(id__in=followings)
         followings_users = self.paginate_queryset(followings_users)
+        # ROW_NUMBER() windows only the recipes of the authors on this page.
+        recipes = Recipe.objects.filter(
+            author__in=followings_users
+        ).defer('search_vector')
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit:
+            recipes = recipes.latest_per_author(int(recipes_limit))
+        recipes = recipes.prefetch_related('image_variants')
+        prefetch_related_objects(
+            followings_users,
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
         serializer = UserWithRecipes(
             followings_users, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
 
+    @action(methods=['POST', 'DELETE'], detail=False, url_path='subscribe',
+            url_name='subscribe-bulk')
+    def subscribe_bulk(self, request):
+        """Subscribes to (POST) or unsubscribes from (DELETE) many authors."""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        current_user = request.user
+        following = set(
+            current_user.follows.filter(author__in=ids)
+            .values_list('author_id', flat=True)
+        )
+        found = set(
+            User.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        statuses = {'self': {current_user.id}}
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = found - following - {current_user.id}
+                Follow.objects.bulk_create(
+                    [Follow(follower=current_user, author_id=pk)
+                     for pk in changed],
+                    ignore_conflicts=True
+                )
+                recount(User, changed, 'followers_count', Follow, 'author')
+                for author_id in changed:
+                    transaction.on_commit(partial(
+                        get_job_backend().submit, feed.backfill,
+                        current_user.id, author_id
+                    ))
+                statuses.update(created=changed, exists=following)
+            else:
+                # One DELETE without the per-row post_delete signals:
+                # followers_count is recounted and the feed entries of
+                # all the authors are dropped at once.
+                rows = Follow.objects.filter(
+                    follower=current_user, author__in=following
+                )
+                rows._raw_delete(rows.db)
+                recount(User, following, 'followers_count', Follow, 'author')
+                feed.drop(current_user.id, *following)
+                statuses.update(deleted=following)
+        return Response({'results': bulk_results(ids, statuses, found)})
+
     @action(methods=['POST', 'DELETE'], detail=True)
     def subscribe(self, request, pk):
         author = get_object_or_404(User, pk=pk)
@@ -173,13 +477,10 @@ class FollowViewSet(GenericViewSet):
                     )
                     response_status = status.HTTP_400_BAD_REQUEST
                 else:
-                    current_user.follows.create(author=author)
-                    user_with_num_recipes = (
-                        User.objects.filter(pk=pk)
-                        .annotate(recipes_count=Count('recipes__id'))
-                    )
+                    with transaction.atomic():
+                        current_user.follows.create(author=author)
                     serializer = UserWithRecipes(
-                        user_with_num_recipes[0], context={'request': request}
+                        author, context={'request': request}
                     )
                     resp = serializer.data
                     response_status = status.HTTP_201_CREATED
@@ -191,3 +492,15 @@ class FollowViewSet(GenericViewSet):
                     current_user.follows.filter(author=author).delete()
                     response_status = status.HTTP_204_NO_CONTENT
         return Response(resp, status=response_status)
+
+
+class MetricsView(APIView):
+    """Prometheus exposition of the metrics of all worker processes."""
+    permission_classes = [HasMetricsToken | IsAdmin]
+    renderer_classes = [PlainTextRenderer]
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.exposition(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -28,12 +28,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryStatsMiddleware',
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -139,3 +143,119 @@ DJOSER = {
     },
     'HIDE_USERS': False
 }
+
+CACHES = {
+    'default': {
+        'BACKEND':
+            os.getenv('CACHE_BACKEND',
+                      default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION':
+            os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+# Lifetime of cached tag/ingredient responses. Entries are keyed by the
+# catalogue version, so with a shared cache edits are visible at once;
+# with the local-memory cache other workers catch up within this time.
+CATALOGUE_CACHE_TIMEOUT = 300
+
+# Rendered shopping list PDFs are cached by a hash of their lines.
+SHOPLIST_PDF_CACHE_TIMEOUT = 60 * 60
+
+# Background jobs: BACKEND is a dotted path to an api.jobs.BaseJobBackend
+# subclass, OPTIONS are passed to its constructor.
+JOBS = {
+    'BACKEND': 'api.jobs.ThreadPoolJobBackend',
+    'OPTIONS': {'workers': 2},
+}
+
+# Asynchronously rendered shopping lists are kept for TTL seconds, failed
+# jobs for FAILED_TTL seconds after the failure. Expired jobs are deleted
+# by new jobs, at most once per PURGE_INTERVAL seconds in each worker.
+SHOPLIST_JOBS = {
+    'ROOT': os.getenv('SHOPLIST_JOBS_ROOT',
+                   default=os.path.join(BASE_DIR, 'shoplist_jobs')),
+    'TTL': 60 * 60,
+    'FAILED_TTL': 5 * 60,
+    'PURGE_INTERVAL': 60,
+}
+
+# Followed authors feed: recipes are copied into followers' inboxes in
+# batches, authors with more followers are read on demand instead.
+FEED = {
+    'FANOUT_MAX_FOLLOWERS': 10000,
+    'FANOUT_BATCH_SIZE': 1000,
+    'BACKFILL_RECIPES': 50,
+}
+
+# Seconds before the in-memory ingredient index is rebuilt even without
+# local changes (picks up edits made by other worker processes).
+INGREDIENT_INDEX_TTL = 300
+
+# Recipe images: uploads larger than MAX_BYTES or MAX_PIXELS are rejected
+# before they are stored; resized variants are rendered in the background.
+RECIPE_IMAGES = {
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'MAX_PIXELS': 40_000_000,
+}
+
+# Request instrumentation (api.middleware.ServerTimingMiddleware): a
+# SAMPLE_RATE share of requests under PATH_PREFIX gets a Server-Timing
+# header; those slower than THRESHOLDS[view name] (or 'default'), in ms,
+# are also logged to the api.timing logger.
+SERVER_TIMING = {
+    'ENABLED': os.getenv('SERVER_TIMING', default='') == '1',
+    'PATH_PREFIX': '/api/',
+    'SAMPLE_RATE': 1.0,
+    'THRESHOLDS': {
+        'default': 0,
+    },
+}
+
+# Prometheus metrics at /api/metrics, kept per worker process in ROOT and
+# merged on scrape. Scrapers authenticate with "Bearer TOKEN", admins
+# with their usual token. Off unless METRICS=1.
+METRICS = {
+    'ENABLED': os.getenv('METRICS', default='') == '1',
+    'PATH_PREFIX': '/api/',
+    'ROOT': os.getenv('METRICS_ROOT',
+                      default=os.path.join(BASE_DIR, 'metrics')),
+    'FLUSH_INTERVAL': 5,
+    'TOKEN': os.getenv('METRICS_TOKEN', default=''),
+}
+
+# On-demand profiling of single requests by admins: "X-Profile: prof" or
+# "?_profile=collapsed" (see api.middleware.ProfilingMiddleware).
+PROFILING = {
+    'ENABLED': True,
+    'SAMPLE_INTERVAL': 0.001,
+}
+
+# SQL statistics by fingerprint per view (api.querystats), flushed to the
+# QueryFingerprint table by a background thread every FLUSH_INTERVAL
+# seconds. SELECTs slower than SLOW_MS get an EXPLAIN, refreshed after
+# EXPLAIN_TTL seconds.
+QUERY_STATS = {
+    'ENABLED': os.getenv('QUERY_STATS', default='') == '1',
+    'PATH_PREFIX': '/api/',
+    'SAMPLE_RATE': 1.0,
+    'SLOW_MS': 100,
+    'FLUSH_INTERVAL': 30,
+    'EXPLAIN_TTL': 24 * 60 * 60,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.getenv('API_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 
 from .models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
                      ShopRecipe, Tag)
+from .search import search_recipes, update_search_index
 
 User = get_user_model()
 
@@ -26,12 +27,20 @@ class RecipeIngredientInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = [RecipeIngredientInline, ]
-    list_display = ('name', 'author', 'favorites',)
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count',)
+    list_select_related = ('author',)
     list_filter = ('author', 'name', 'tags',)
     search_fields = ('text', )
+    readonly_fields = ('favorites_count', 'in_carts_count',)
 
-    def favorites(self, obj):
-        return FavoriteRecipe.objects.filter(recipe=obj).count()
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search_recipes(queryset, search_term), False
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_search_index([form.instance.pk])
 
 
 @admin.register(RecipeIngredient)
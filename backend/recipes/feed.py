@@ -0,0 +1,125 @@
+"""
+Лента рецептов от авторов, на которых подписан пользователь.
+
+Новый рецепт раскладывается во входящие (FeedItem) подписчиков автора
+пачками (fan-out on write), чтение ленты - один проход по индексу
+(owner, pub_date, recipe). Рецепты авторов, у которых подписчиков больше
+FEED['FANOUT_MAX_FOLLOWERS'], не раскладываются: их подписчики дочитывают
+такие рецепты напрямую при чтении ленты (pull).
+"""
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+
+from users.models import Follow
+
+from .models import FeedItem, Recipe
+
+
+def is_pull_author(author):
+    return author.followers_count > settings.FEED['FANOUT_MAX_FOLLOWERS']
+
+
+def fan_out(recipe_id):
+    """Кладёт рецепт во входящие всех подписчиков автора."""
+    recipe = Recipe.objects.select_related('author').filter(
+        pk=recipe_id
+    ).first()
+    if recipe is None or is_pull_author(recipe.author):
+        return
+    batch_size = settings.FEED['FANOUT_BATCH_SIZE']
+    followers = (
+        Follow.objects.filter(author_id=recipe.author_id)
+        .order_by('follower_id').values_list('follower_id', flat=True)
+    )
+    last_follower_id = 0
+    while True:
+        batch = list(
+            followers.filter(follower_id__gt=last_follower_id)[:batch_size]
+        )
+        if not batch:
+            break
+        FeedItem.objects.bulk_create(
+            [FeedItem(owner_id=follower_id, recipe_id=recipe.pk,
+                      author_id=recipe.author_id, pub_date=recipe.pub_date)
+             for follower_id in batch],
+            ignore_conflicts=True
+        )
+        last_follower_id = batch[-1]
+
+
+def backfill(follower_id, author_id):
+    """Кладёт последние рецепты автора во входящие нового подписчика."""
+    # Подписку могли отменить, пока задание ждало в очереди.
+    if Follow.objects.filter(
+        follower_id=follower_id, author_id=author_id
+    ).exists():
+        backfill_followers(author_id, [follower_id])
+
+
+def backfill_followers(author_id, follower_ids):
+    """Кладёт последние рецепты автора во входящие нескольких подписчиков."""
+    recipes = list(
+        Recipe.objects.filter(author_id=author_id).filter(
+            author__followers_count__lte=settings.FEED['FANOUT_MAX_FOLLOWERS']
+        ).order_by('-pub_date')
+        .values_list('pk', 'pub_date')[:settings.FEED['BACKFILL_RECIPES']]
+    )
+    FeedItem.objects.bulk_create(
+        [FeedItem(owner_id=follower_id, recipe_id=recipe_id,
+                  author_id=author_id, pub_date=pub_date)
+         for follower_id in follower_ids
+         for recipe_id, pub_date in recipes],
+        ignore_conflicts=True,
+        batch_size=settings.FEED['FANOUT_BATCH_SIZE']
+    )
+
+
+def drop(follower_id, *author_ids):
+    """Убирает из ленты подписчика рецепты авторов одним DELETE."""
+    FeedItem.objects.filter(
+        owner_id=follower_id, author_id__in=author_ids
+    ).delete()
+
+
+def before(position, date_field, id_field):
+    """Условие "строго раньше позиции (pub_date, id)" для пагинации."""
+    if position is None:
+        return Q()
+    pub_date, pk = position
+    return (
+        Q(**{f'{date_field}__lt': pub_date})
+        | Q(**{date_field: pub_date, f'{id_field}__lt': pk})
+    )
+
+
+def read_feed(user, position, limit):
+    """
+    (pub_date, id рецепта) для страницы ленты не длиннее limit, начиная
+    строго после position.
+    """
+    inbox = list(
+        FeedItem.objects.filter(owner=user)
+        # Раскладка, которая разминулась с отпиской, оставляет записи
+        # автора, на которого пользователь уже не подписан.
+        .filter(Exists(Follow.objects.filter(
+            follower=user, author=OuterRef('author')
+        )))
+        .filter(before(position, 'pub_date', 'recipe_id'))
+        .order_by('-pub_date', '-recipe_id')
+        .values_list('pub_date', 'recipe_id')[:limit]
+    )
+    pulled = list(
+        Recipe.objects.filter(
+            author__in=user.follows.filter(
+                author__followers_count__gt=(
+                    settings.FEED['FANOUT_MAX_FOLLOWERS']
+                )
+            ).values('author')
+        )
+        .filter(before(position, 'pub_date', 'id'))
+        .order_by('-pub_date', '-id')
+        .values_list('pub_date', 'id')[:limit]
+    )
+    if not pulled:
+        return inbox
+    return sorted(set(inbox + pulled), reverse=True)[:limit]
@@ -0,0 +1,96 @@
+"""
+Варианты картинок рецептов.
+
+Загруженная картинка хранится как есть, а для списков и карточек в фоне
+рендерятся уменьшенные копии (VARIANTS) в WebP и JPEG. Файлы хранятся
+в контентно-адресуемом хранилище (recipes.storage), поэтому одинаковые
+копии не дублируются, а URL меняется вместе с содержимым.
+"""
+import io
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .models import ImageVariant, Recipe
+
+VARIANTS = {
+    ImageVariant.THUMB: (160, 160),
+    ImageVariant.CARD: (480, 480),
+    ImageVariant.FULL: (1280, 1280),
+}
+FORMATS = {
+    ImageVariant.WEBP: ('WEBP', {'quality': 80, 'method': 4}),
+    ImageVariant.JPEG: ('JPEG', {'quality': 85, 'optimize': True,
+                                 'progressive': True}),
+}
+
+
+def flatten(image):
+    """Приводит картинку к RGB, прозрачные места заливаются белым."""
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, image_format):
+    name, options = FORMATS[image_format]
+    buffer = io.BytesIO()
+    image.save(buffer, name, **options)
+    return buffer.getvalue()
+
+
+def render_variants(recipe_id):
+    """Рендерит все варианты текущей картинки рецепта."""
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    rendered = recipe.image_variants.filter(source=source).count()
+    if rendered == len(VARIANTS) * len(FORMATS):
+        return
+    with recipe.image.open('rb') as file, Image.open(file) as original:
+        original = flatten(ImageOps.exif_transpose(original))
+    storage = ImageVariant._meta.get_field('file').storage
+    variants = []
+    for kind, size in VARIANTS.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        for image_format in FORMATS:
+            variants.append(ImageVariant(
+                recipe_id=recipe_id,
+                source=source,
+                kind=kind,
+                format=image_format,
+                file=storage.save(
+                    f'{kind}.{image_format}',
+                    ContentFile(encode(image, image_format))
+                ),
+                width=image.width,
+                height=image.height
+            ))
+    with transaction.atomic():
+        # Картинку могли заменить, пока рендерились варианты: тогда
+        # результат устарел, а новые варианты отрендерит следующая задача.
+        if not Recipe.objects.select_for_update().filter(
+            pk=recipe_id, image=source
+        ).exists():
+            for variant in variants:
+                storage.delete(variant.file.name)
+            return
+        ImageVariant.objects.filter(recipe_id=recipe_id).delete()
+        ImageVariant.objects.bulk_create(variants)
+
+
+def variant_urls(recipe, request=None):
+    """Ссылки на варианты картинки: {kind: {format: url}}."""
+    urls = {}
+    for variant in recipe.image_variants.all():
+        url = variant.file.url
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        urls.setdefault(variant.kind, {})[variant.format] = url
+    return urls
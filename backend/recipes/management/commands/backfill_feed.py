@@ -0,0 +1,46 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from recipes import feed
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the subscription feeds from the existing follows: the last '
+        'FEED["BACKFILL_RECIPES"] recipes of every followed author, '
+        'skipping authors read by pull.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of follows read per query.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        follows = Follow.objects.order_by('author_id', 'follower_id')
+        done, position = 0, Q()
+        while True:
+            batch = list(
+                follows.filter(position)
+                .values_list('author_id', 'follower_id')[:batch_size]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                for author_id, rows in groupby(batch, key=lambda row: row[0]):
+                    feed.backfill_followers(
+                        author_id, [follower_id for _, follower_id in rows]
+                    )
+            done += len(batch)
+            author_id, follower_id = batch[-1]
+            position = (
+                Q(author_id__gt=author_id)
+                | Q(author_id=author_id, follower_id__gt=follower_id)
+            )
+        self.stdout.write(f'Обработано подписок: {done}')
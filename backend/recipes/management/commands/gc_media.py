@@ -0,0 +1,112 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import ImageBlob, ImageVariant, Recipe
+from recipes.storage import PREFIX
+from recipes.utils import chunked
+
+REFERENCES = (
+    (Recipe, 'image'),
+    (ImageVariant, 'file'),
+)
+
+
+def walk(root):
+    """
+    Yields (path, size, mtime) of every file under root.
+
+    Directories are read with os.scandir one at a time, so only the
+    stack of directories still to visit is kept in memory.
+    """
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+
+def referenced(names):
+    """Names from names that some image field still points to."""
+    found = set()
+    for model, field_name in REFERENCES:
+        found.update(
+            model.objects.filter(**{f'{field_name}__in': names})
+            .values_list(field_name, flat=True)
+        )
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Delete media files that no recipe or image variant refers to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='Keep unreferenced files younger than this.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of files checked per query.'
+        )
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Maximum files deleted per second, 0 for no limit.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the files that would be deleted.'
+        )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        roots = {PREFIX} | {
+            model._meta.get_field(field_name).upload_to.split('/')[0]
+            for model, field_name in REFERENCES
+        }
+        cutoff = time.time() - options['grace_hours'] * 60 * 60
+        delay = 1 / options['rate'] if options['rate'] else 0
+        scanned, orphans, freed = 0, 0, 0
+        for root in sorted(roots):
+            files = walk(storage.path(root))
+            for chunk in chunked(files, options['chunk_size']):
+                scanned += len(chunk)
+                names = {
+                    os.path.relpath(path, storage.location).replace(
+                        os.sep, '/'
+                    ): (path, size, mtime)
+                    for path, size, mtime in chunk
+                }
+                in_use = referenced(list(names))
+                deleted = []
+                for name, (path, size, mtime) in names.items():
+                    if name in in_use or mtime > cutoff:
+                        continue
+                    orphans += 1
+                    freed += size
+                    if options['dry_run']:
+                        self.stdout.write(name)
+                        continue
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    deleted.append(name)
+                    if delay:
+                        time.sleep(delay)
+                if deleted:
+                    ImageBlob.objects.filter(name__in=deleted).delete()
+        action = 'Найдено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'Проверено файлов: {scanned}. {action} неиспользуемых: '
+            f'{orphans} ({freed} байт)'
+        )
@@ -2,6 +2,8 @@ import json
 
 from django.core.management.base import BaseCommand
 
+from api.cache import bump_catalogue_version
+from api.indexes import ingredient_index
 from recipes.models import Ingredient, Tag
 
 ALREADY_LOADED_ERROR_MESSAGE = (
@@ -16,6 +18,13 @@ class Command(BaseCommand):
     help = 'Load data in database (SQLite3) from CSV-file.'
 
     def handle(self, *args, **kwargs):
+        self.load()
+        # bulk_create не шлёт post_save, поэтому кэш справочников и
+        # индекс ингредиентов сбрасываются явно.
+        bump_catalogue_version()
+        ingredient_index.invalidate()
+
+    def load(self):
         if Ingredient.objects.exists():
             print(ALREADY_LOADED_ERROR_MESSAGE)
         else:
@@ -0,0 +1,72 @@
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+
+from recipes.models import ImageVariant, Recipe
+from recipes.storage import PREFIX
+
+FIELDS = (
+    (Recipe, 'image'),
+    (ImageVariant, 'file'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Move existing recipe images into the content-addressed storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of rows loaded per query.'
+        )
+        parser.add_argument(
+            '--keep-originals', action='store_true',
+            help='Do not delete the old files after moving them.'
+        )
+
+    def handle(self, *args, **options):
+        for model, field_name in FIELDS:
+            moved, missing = self.migrate_field(model, field_name, **options)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: перенесено {moved}, '
+                f'файлов не найдено {missing}'
+            )
+
+    @staticmethod
+    def migrate_field(model, field_name, batch_size, keep_originals,
+                      **options):
+        field = model._meta.get_field(field_name)
+        legacy_storage = FileSystemStorage(location=field.storage.location)
+        rows = (
+            model.objects.exclude(**{f'{field_name}__startswith': PREFIX})
+            .exclude(**{field_name: ''}).order_by('pk')
+        )
+        moved, missing, last_pk = 0, 0, 0
+        while True:
+            batch = list(
+                rows.filter(pk__gt=last_pk)
+                .values_list('pk', field_name)[:batch_size]
+            )
+            if not batch:
+                break
+            for pk, name in batch:
+                if not legacy_storage.exists(name):
+                    missing += 1
+                    continue
+                with legacy_storage.open(name, 'rb') as file:
+                    new_name = field.storage.save(name, file)
+                # update() без сигналов: картинка та же, меняется только имя.
+                updated = model.objects.filter(
+                    pk=pk, **{field_name: name}
+                ).update(**{field_name: new_name})
+                if not updated:
+                    field.storage.delete(new_name)
+                    continue
+                moved += 1
+                if not keep_originals and new_name != name:
+                    # Старым файлом может пользоваться ещё одна запись.
+                    if not rows.filter(**{field_name: name}).exists():
+                        os.remove(legacy_storage.path(name))
+            last_pk = batch[-1][0]
+        return moved, missing
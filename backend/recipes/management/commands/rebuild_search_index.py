@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import update_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of recipes in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of recipes indexed per batch.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        indexed, last_pk = 0, 0
+        while True:
+            batch = list(
+                Recipe.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            update_search_index(batch)
+            indexed += len(batch)
+            last_pk = batch[-1]
+        self.stdout.write(f'Проиндексировано рецептов: {indexed}')
@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes.models import FavoriteRecipe, Recipe, ShopRecipe
+from recipes.signals import count_of
+from users.models import Follow
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'in_carts_count', ShopRecipe, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Repair drift of denormalized counters in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows checked per query.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, field, related_model, related_field in COUNTERS:
+            actual = count_of(related_model, related_field)
+            repaired, last_pk = 0, 0
+            while True:
+                batch = list(
+                    model.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', flat=True)[:batch_size]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1]
+                drifted = list(
+                    model.objects.filter(pk__in=batch)
+                    .annotate(actual=actual).exclude(**{field: F('actual')})
+                    .values_list('pk', flat=True)
+                )
+                if drifted:
+                    repaired += model.objects.filter(pk__in=drifted).update(
+                        **{field: actual}
+                    )
+            self.stdout.write(
+                f'{model._meta.label}.{field}: исправлено {repaired}'
+            )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import render_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Render missing image variants of existing recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of recipe ids loaded per query.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        processed, failed, last_pk = 0, 0, 0
+        while True:
+            batch = list(
+                Recipe.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            for recipe_id in batch:
+                try:
+                    render_variants(recipe_id)
+                except OSError as error:
+                    failed += 1
+                    self.stderr.write(f'Рецепт {recipe_id}: {error}')
+            processed += len(batch)
+            last_pk = batch[-1]
+        self.stdout.write(
+            f'Обработано рецептов: {processed}, с ошибками: {failed}'
+        )
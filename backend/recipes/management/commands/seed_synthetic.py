@@ -0,0 +1,318 @@
+import io
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShopRecipe, Tag)
+from recipes.utils import chunked
+from users.models import Follow
+
+User = get_user_model()
+
+WORDS = (
+    'суп', 'борщ', 'салат', 'пирог', 'каша', 'рагу', 'котлеты', 'блины',
+    'запеканка', 'плов', 'паста', 'соус', 'томатный', 'куриный', 'овощной',
+    'грибной', 'сырный', 'домашний', 'быстрый', 'острый', 'сладкий',
+    'летний', 'с картошкой', 'с рисом', 'на углях', 'в духовке',
+)
+
+
+class Zipf:
+    """
+    Items drawn with probability proportional to 1 / rank ** exponent.
+
+    Ranks are assigned to a shuffled copy of items, so popularity does not
+    follow the order of ids.
+    """
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.weights = [
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)
+        ]
+        self.cum_weights = list(accumulate(self.weights))
+        self.rng = rng
+
+    def sample(self, count):
+        return self.rng.choices(
+            self.items, cum_weights=self.cum_weights, k=count
+        )
+
+    def distinct(self, count, exclude=None):
+        """count different items, without exclude."""
+        limit = len(self.items) - (exclude is not None)
+        count = min(count, limit)
+        if count > limit // 10:
+            # Rejection sampling from the long tail would take forever,
+            # a large share of the items is drawn uniformly instead.
+            chosen = self.rng.sample(
+                self.items, min(count + 1, len(self.items))
+            )
+            return [item for item in chosen if item != exclude][:count]
+        chosen = set()
+        while len(chosen) < count:
+            chosen.update(self.sample(count - len(chosen)))
+            chosen.discard(exclude)
+        return list(chosen)
+
+    def shares(self, total):
+        """(item, count) summing up to total, proportional to weights."""
+        scale = total / self.cum_weights[-1]
+        carry = 0.0
+        for item, weight in zip(self.items, self.weights):
+            carry += weight * scale
+            count = int(carry)
+            carry -= count
+            if count:
+                yield item, count
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with synthetic users, recipes, favorites, '
+        'shopping carts and follows for benchmarks. Popularity of recipes '
+        'and authors and activity of users follow Zipf distributions. '
+        'Rows are streamed with COPY on PostgreSQL and executemany in '
+        'batches elsewhere. The same --seed gives the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8,
+            help='Average number of ingredients of a recipe.'
+        )
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--favorites', type=int, default=1000000)
+        parser.add_argument('--carts', type=int, default=100000)
+        parser.add_argument('--follows', type=int, default=200000)
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help='Zipf exponent: 0 is uniform, larger is more skewed.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--start', default='2022-01-01',
+            help='Date of the first synthetic recipe.'
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Recipes are published evenly over this many days.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=50000,
+            help='Rows per COPY or executemany call.'
+        )
+        parser.add_argument(
+            '--image', default='recipes/synthetic.png',
+            help='Image name stored in every synthetic recipe.'
+        )
+        parser.add_argument(
+            '--search-index', action='store_true',
+            help='Rebuild the full-text search index afterwards.'
+        )
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        if not ingredient_ids:
+            raise CommandError('Нет ингредиентов, сначала load_ingredients.')
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.start = datetime.fromisoformat(options['start']).replace(
+            tzinfo=timezone.utc
+        )
+        skew = options['skew']
+        tag_ids = [
+            Tag.objects.get_or_create(
+                slug=f'tag-{number}',
+                defaults={'name': f'Тег {number}', 'color': '#000000'}
+            )[0].pk
+            for number in range(options['tags'])
+        ]
+        first_user = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        first_recipe = (
+            Recipe.objects.aggregate(last=Max('pk'))['last'] or 0
+        ) + 1
+        user_ids = range(first_user, first_user + options['users'])
+        recipe_ids = range(first_recipe, first_recipe + options['recipes'])
+        with transaction.atomic():
+            self.write(User, (
+                'id', 'password', 'last_login', 'is_superuser', 'username',
+                'is_staff', 'is_active', 'date_joined', 'email',
+                'first_name', 'last_name', 'recipes_count', 'followers_count',
+            ), self.users(user_ids))
+            authors = Zipf(user_ids, skew, self.rng)
+            self.write(Recipe, (
+                'id', 'author', 'name', 'text', 'image', 'cooking_time',
+                'pub_date', 'favorites_count', 'in_carts_count',
+            ), self.recipes(recipe_ids, authors))
+            self.write(
+                RecipeIngredient, ('recipe', 'ingredient', 'amount'),
+                self.recipe_ingredients(
+                    recipe_ids, Zipf(ingredient_ids, skew, self.rng)
+                )
+            )
+            self.write(
+                Recipe.tags.through, ('recipe', 'tag'),
+                self.recipe_tags(recipe_ids, Zipf(tag_ids, skew, self.rng))
+            )
+            users = Zipf(user_ids, skew, self.rng)
+            popular = Zipf(recipe_ids, skew, self.rng)
+            for model, total in ((FavoriteRecipe, options['favorites']),
+                                 (ShopRecipe, options['carts'])):
+                self.write(
+                    model, ('user', 'recipe'),
+                    self.pairs(users, popular, total)
+                )
+            self.write(
+                Follow, ('follower', 'author'),
+                self.pairs(users, authors, options['follows'], distinct=True)
+            )
+            self.reset_sequences()
+        self.analyze()
+        call_command('recount', stdout=self.stdout)
+        if options['search_index']:
+            call_command('rebuild_search_index', stdout=self.stdout)
+
+    def users(self, user_ids):
+        password = make_password('synthetic')
+        seed = self.options['seed']
+        for user_id in user_ids:
+            username = f'synthetic_{seed}_{user_id}'
+            yield (
+                user_id, password, None, False, username, False, True,
+                self.start, f'{username}@example.com', 'Синтетический',
+                f'Пользователь {user_id}', 0, 0,
+            )
+
+    def recipes(self, recipe_ids, authors):
+        rng = self.rng
+        step = self.options['days'] * 24 * 60 * 60 / max(len(recipe_ids), 1)
+        for number, (recipe_id, author_id) in enumerate(
+            zip(recipe_ids, authors.sample(len(recipe_ids)))
+        ):
+            name = ' '.join(rng.sample(WORDS, 2)).capitalize()
+            text = ' '.join(rng.choices(WORDS, k=rng.randint(8, 30)))
+            pub_date = self.start + timedelta(
+                seconds=(number + rng.random()) * step
+            )
+            yield (
+                recipe_id, author_id, name, text, self.options['image'],
+                rng.randint(1, 180), pub_date, 0, 0,
+            )
+
+    def recipe_ingredients(self, recipe_ids, ingredients):
+        average = self.options['ingredients_per_recipe']
+        low, high = max(1, average - average // 2), average + average // 2
+        for recipe_id in recipe_ids:
+            count = self.rng.randint(low, high)
+            for ingredient_id in ingredients.distinct(count):
+                yield recipe_id, ingredient_id, self.rng.randint(1, 500)
+
+    def recipe_tags(self, recipe_ids, tags):
+        for recipe_id in recipe_ids:
+            for tag_id in tags.distinct(self.rng.randint(1, 3)):
+                yield recipe_id, tag_id
+
+    @staticmethod
+    def pairs(owners, targets, total, distinct=False):
+        """
+        (owner, target) rows, total at most, without repeats.
+
+        Active owners get more rows (Zipf shares, at most half of the
+        targets), targets are drawn by popularity. With distinct an owner
+        is never paired with itself.
+        """
+        most = len(targets.items) // 2
+        for owner, count in owners.shares(total):
+            exclude = owner if distinct else None
+            for target in targets.distinct(min(count, most), exclude):
+                yield owner, target
+
+    def write(self, model, field_names, rows):
+        table = model._meta.db_table
+        columns = [
+            model._meta.get_field(name).column for name in field_names
+        ]
+        start = perf_counter()
+        written = 0
+        with connection.cursor() as cursor:
+            for batch in chunked(rows, self.options['batch_size']):
+                if connection.vendor == 'postgresql':
+                    self.copy(cursor, table, columns, batch)
+                else:
+                    self.insert(cursor, table, columns, batch)
+                written += len(batch)
+        self.stdout.write(
+            f'{table}: {written} строк за {perf_counter() - start:.1f} с'
+        )
+
+    @staticmethod
+    def copy(cursor, table, columns, batch):
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write('\t'.join(map(copy_value, row)))
+            buffer.write('\n')
+        buffer.seek(0)
+        quoted = ', '.join(connection.ops.quote_name(name) for name in columns)
+        cursor.copy_expert(
+            f'COPY {connection.ops.quote_name(table)} ({quoted}) FROM STDIN',
+            buffer
+        )
+
+    @staticmethod
+    def insert(cursor, table, columns, batch):
+        adapt = connection.ops.adapt_datetimefield_value
+        quoted = ', '.join(connection.ops.quote_name(name) for name in columns)
+        placeholders = ', '.join(['%s'] * len(columns))
+        cursor.executemany(
+            f'INSERT INTO {connection.ops.quote_name(table)} ({quoted}) '
+            f'VALUES ({placeholders})',
+            [
+                [adapt(value) if isinstance(value, datetime) else value
+                 for value in row]
+                for row in batch
+            ]
+        )
+
+    @staticmethod
+    def reset_sequences():
+        # Users and recipes were inserted with explicit ids.
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipe]
+        )
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    @staticmethod
+    def analyze():
+        """Fresh planner statistics, so EXPLAIN sees the new volumes."""
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.16 on 2026-10-18 15:34
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+import recipes.models
+
+POSTGRES_FORWARD = (
+    "UPDATE recipes_recipe r SET search_vector = "
+    "setweight(to_tsvector('russian', coalesce(r.name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(r.text, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(("
+    "SELECT string_agg(i.name, ' ') FROM recipes_recipeingredient ri "
+    "JOIN recipes_ingredient i ON i.id = ri.ingredient_id "
+    "WHERE ri.recipe_id = r.id), '')), 'C')",
+)
+POSTGRES_BACKWARD = ()
+SQLITE_FORWARD = (
+    "CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5("
+    "name, text, ingredients, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients) "
+    "SELECT id, replace(replace(name, 'ё', 'е'), 'Ё', 'Е'), "
+    "replace(replace(text, 'ё', 'е'), 'Ё', 'Е'), "
+    "replace(replace(ingredients, 'ё', 'е'), 'Ё', 'Е') "
+    "FROM (SELECT r.id, r.name, r.text, coalesce(("
+    "SELECT group_concat(i.name, ' ') FROM recipes_recipeingredient ri "
+    "JOIN recipes_ingredient i ON i.id = ri.ingredient_id "
+    "WHERE ri.recipe_id = r.id), '') AS ingredients "
+    "FROM recipes_recipe r)",
+)
+SQLITE_BACKWARD = (
+    "DROP TABLE IF EXISTS recipes_recipe_fts",
+)
+
+
+def run_for_vendor(postgres, sqlite):
+    def run(apps, schema_editor):
+        statements = {'postgresql': postgres, 'sqlite': sqlite}.get(
+            schema_editor.connection.vendor, ()
+        )
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый индекс'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=recipes.models.SearchVectorIndex(fields=['search_vector'], name='recipe_search_vector_gin'),
+        ),
+        migrations.RunPython(
+            run_for_vendor(POSTGRES_FORWARD, SQLITE_FORWARD),
+            run_for_vendor(POSTGRES_BACKWARD, SQLITE_BACKWARD),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.16 on 2026-10-18 15:46
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagevariant',
+            name='file',
+            field=models.ImageField(db_index=True, height_field='height', storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/variants/', verbose_name='Файл', width_field='width'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Картинка'),
+        ),
+    ]
@@ -1,6 +1,14 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import EmptyResultSet
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from .storage import cas_storage
 
 User = get_user_model()
 
@@ -50,6 +58,52 @@ class Ingredient(models.Model):
         return self.name
 
 
+class SearchVectorIndex(GinIndex):
+    """
+    GIN-индекс поисковой колонки на PostgreSQL.
+
+    На остальных базах колонка не заполняется (поиск идёт через FTS5),
+    и индекс создаётся обычным, чтобы миграции проходили везде.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().create_sql(model, schema_editor, using, **kwargs)
+        return models.Index.create_sql(
+            self, model, schema_editor, using, **kwargs
+        )
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def latest_per_author(self, limit):
+        """
+        Не более limit последних рецептов каждого автора одним запросом.
+
+        Рецепты нумеруются ROW_NUMBER() OVER (PARTITION BY author_id
+        ORDER BY pub_date DESC), внешний запрос оставляет первые limit.
+        Окно строится по self, поэтому авторов нужно отфильтровать до
+        вызова, иначе нумеруется вся таблица рецептов.
+        """
+        ranked = self.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=F('pub_date').desc()
+            )
+        ).values('id', 'row_number')
+        try:
+            sql, params = ranked.query.sql_with_params()
+        except EmptyResultSet:
+            # Например, author__in=[] - рецептов нет.
+            return self.none()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            f'WHERE ranked.row_number <= %s',
+            (*params, limit)
+        ))
+
+
 class Recipe(models.Model):
     """Модель рецепта."""
     author = models.ForeignKey(
@@ -69,6 +123,8 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/',
+        storage=cas_storage,
+        db_index=True,
         blank=False,
         verbose_name='Картинка'
     )
@@ -96,11 +152,37 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый индекс'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            # Рецепты автора, последние рецепты авторов в подписках и лента.
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            SearchVectorIndex(fields=['search_vector'],
+                              name='recipe_search_vector_gin'),
+        ]
 
     def __str__(self):
         return f'"{self.name}" (c) {self.author}'
@@ -194,3 +276,124 @@ class ShopRecipe(UserRecipe):
         ]
         verbose_name = 'Рецепт для списка покупок пользователя'
         verbose_name_plural = 'Рецепты для списка покупок пользователя'
+
+
+class FeedItem(models.Model):
+    """Запись ленты подписок: рецепт автора во входящих подписчика."""
+    owner = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Владелец ленты',
+        related_name='feed_items'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_items'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор рецепта',
+        related_name='+'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'recipe'],
+                                    name='UQ_feed_owner_recipe')
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-pub_date', '-recipe'],
+                         name='feed_owner_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner} feed: {self.recipe}'
+
+
+class ImageVariant(models.Model):
+    """Уменьшенная копия картинки рецепта в одном из форматов."""
+    THUMB, CARD, FULL = 'thumb', 'card', 'full'
+    KINDS = (
+        (THUMB, 'Миниатюра'),
+        (CARD, 'Карточка'),
+        (FULL, 'Полный размер'),
+    )
+    WEBP, JPEG = 'webp', 'jpeg'
+    FORMATS = (
+        (WEBP, 'WebP'),
+        (JPEG, 'JPEG'),
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='image_variants'
+    )
+    source = models.CharField(
+        max_length=255,
+        verbose_name='Исходная картинка'
+    )
+    kind = models.CharField(
+        max_length=10,
+        choices=KINDS,
+        verbose_name='Размер'
+    )
+    format = models.CharField(
+        max_length=10,
+        choices=FORMATS,
+        verbose_name='Формат'
+    )
+    file = models.ImageField(
+        upload_to='recipes/variants/',
+        storage=cas_storage,
+        db_index=True,
+        width_field='width',
+        height_field='height',
+        verbose_name='Файл'
+    )
+    width = models.PositiveIntegerField(verbose_name='Ширина')
+    height = models.PositiveIntegerField(verbose_name='Высота')
+
+    class Meta:
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'kind', 'format'],
+                                    name='UQ_image_variant')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}: {self.kind}.{self.format}'
+
+
+class ImageBlob(models.Model):
+    """Файл контентно-адресуемого хранилища и число ссылок на него."""
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Имя файла'
+    )
+    size = models.PositiveBigIntegerField(verbose_name='Размер')
+    refcount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число ссылок'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата загрузки'
+    )
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
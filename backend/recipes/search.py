@@ -0,0 +1,138 @@
+"""
+Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+
+На PostgreSQL индекс - колонка Recipe.search_vector (tsvector, русская
+конфигурация) с GIN-индексом, на SQLite - таблица FTS5 recipes_recipe_fts
+с rowid = id рецепта. Индекс обновляется явно: update_search_index()
+после записи рецепта с ингредиентами.
+"""
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connections
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe, RecipeIngredient
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# Веса bm25 для колонок name, text, ingredients.
+FTS_WEIGHTS = '10.0, 2.0, 5.0'
+
+
+def fold_yo(text):
+    """FTS5 не отождествляет ё и е - приводим сами."""
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def get_vendor(using='default'):
+    return connections[using].vendor
+
+
+def update_search_index(recipe_ids, using='default'):
+    """Пересчитывает поисковый индекс рецептов (список id или подзапрос)."""
+    vendor = get_vendor(using)
+    if vendor == 'postgresql':
+        ingredient_names = (
+            RecipeIngredient.objects
+            .filter(recipe=OuterRef('pk')).order_by().values('recipe')
+            .annotate(names=StringAgg('ingredient__name', ' '))
+            .values('names')
+        )
+        Recipe.objects.using(using).filter(pk__in=recipe_ids).update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+                + SearchVector(Subquery(ingredient_names), weight='C',
+                               config=SEARCH_CONFIG)
+            )
+        )
+    elif vendor == 'sqlite':
+        recipes = {
+            pk: [name, text, []]
+            for pk, name, text in Recipe.objects.using(using)
+            .filter(pk__in=recipe_ids).values_list('pk', 'name', 'text')
+        }
+        for recipe_id, name in (
+            RecipeIngredient.objects.using(using)
+            .filter(recipe_id__in=list(recipes))
+            .values_list('recipe_id', 'ingredient__name')
+        ):
+            recipes[recipe_id][2].append(name)
+        delete_from_search_index(list(recipes), using)
+        with connections[using].cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+                f'VALUES (%s, %s, %s, %s)',
+                [(pk, fold_yo(name), fold_yo(text),
+                  fold_yo(' '.join(ingredients)))
+                 for pk, (name, text, ingredients) in recipes.items()]
+            )
+
+
+def reindex_ingredient(ingredient_id):
+    """Пересчитывает индекс рецептов с переименованным ингредиентом."""
+    update_search_index(
+        Recipe.objects.filter(ingredients=ingredient_id).values('pk')
+    )
+
+
+def delete_from_search_index(recipe_ids, using='default'):
+    if get_vendor(using) != 'sqlite' or not recipe_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+            list(recipe_ids)
+        )
+
+
+def fts5_query(text):
+    """Запрос FTS5: каждое слово как префикс, спецсимволы отбрасываются."""
+    words = re.findall(r'\w+', fold_yo(text))
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_recipes(queryset, text):
+    """Рецепты queryset, подходящие под запрос, по убыванию релевантности."""
+    vendor = get_vendor(queryset.db)
+    if vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(search_rank=SearchRank(F('search_vector'), query))
+            .order_by('-search_rank', '-pub_date')
+        )
+    if vendor == 'sqlite':
+        match = fts5_query(text)
+        if not match:
+            return queryset.none()
+        # Ранг - коррелированный подзапрос к выборке FTS. LIMIT -1 не даёт
+        # SQLite развернуть её в подзапрос: MATCH и bm25() выполняются
+        # один раз, дальше ранг ищется по автоматическому индексу, а не
+        # новым MATCH для каждого рецепта.
+        table = Recipe._meta.db_table
+        return (
+            queryset
+            .filter(pk__in=RawSQL(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                (match,)
+            ))
+            .annotate(search_rank=RawSQL(
+                f'SELECT ranked.rank FROM (SELECT rowid AS id, '
+                f'-bm25({FTS_TABLE}, {FTS_WEIGHTS}) AS rank FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s LIMIT -1) ranked '
+                f'WHERE ranked.id = {table}.id',
+                (match,)
+            ))
+            .order_by('-search_rank', '-pub_date')
+        )
+    return queryset.filter(
+        Q(name__icontains=text) | Q(text__icontains=text)
+        | Q(recipe_ingredients__ingredient__name__icontains=text)
+    ).distinct()
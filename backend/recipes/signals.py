@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FavoriteRecipe, ImageVariant, Recipe, ShopRecipe
+from .search import delete_from_search_index
+
+User = get_user_model()
+
+
+def shift_counter(model, pk, field, delta):
+    """Атомарно сдвигает счётчик на delta, не опуская его ниже нуля."""
+    rows = model.objects.filter(pk=pk)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: F(field) + delta})
+
+
+def count_of(model, field):
+    """Подзапрос: число строк model, у которых field ссылается на строку."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field).annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def recount(model, pks, field, related_model, related_field):
+    """Пересчитывает счётчик строк pks по фактическому числу связей."""
+    model.objects.filter(pk__in=pks).update(
+        **{field: count_of(related_model, related_field)}
+    )
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+def favorite_created(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def favorite_deleted(sender, instance, **kwargs):
+    shift_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=ShopRecipe)
+def cart_recipe_created(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(Recipe, instance.recipe_id, 'in_carts_count', 1)
+
+
+@receiver(post_delete, sender=ShopRecipe)
+def cart_recipe_deleted(sender, instance, **kwargs):
+    shift_counter(Recipe, instance.recipe_id, 'in_carts_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    shift_counter(User, instance.author_id, 'recipes_count', -1)
+    delete_from_search_index([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=ImageVariant)
+def release_image(sender, instance, **kwargs):
+    """Снимает ссылку на файл картинки удалённой записи."""
+    field = instance.image if sender is Recipe else instance.file
+    if field:
+        name, storage = field.name, field.storage
+        transaction.on_commit(lambda: storage.delete(name))
@@ -0,0 +1,141 @@
+"""
+Контентно-адресуемое хранилище картинок.
+
+Файл хранится под sha256 своего содержимого (cas/ab/cd/<sha256>.<ext>):
+одинаковые загрузки занимают место один раз, а по одному имени никогда
+не лежит разное содержимое, поэтому nginx отдаёт эти пути с
+Cache-Control: immutable. Ссылки на файл считает ImageBlob: save()
+добавляет ссылку, delete() снимает её и удаляет файл, когда ссылок не
+осталось.
+"""
+import hashlib
+import os
+import uuid
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+PREFIX = 'cas/'
+
+
+def content_digest(content) -> str:
+    """Считает sha256 файла, читая его по частям."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def can_upsert(connection):
+    """INSERT ... ON CONFLICT DO UPDATE ... RETURNING поддерживается."""
+    if connection.vendor == 'postgresql':
+        return True
+    return (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 35)
+    )
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, которое именует файлы по содержимому."""
+
+    @staticmethod
+    def blob_name(digest, extension):
+        return f'{PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        extension = os.path.splitext(name)[1].lower()
+        name = self.blob_name(content_digest(content), extension)
+        existed = self.exists(name)
+        if existed:
+            # Свежее время изменения не даёт gc_media удалить файл, пока
+            # запись со ссылкой на него ещё не сохранена.
+            try:
+                os.utime(self.path(name))
+            except FileNotFoundError:
+                existed = False
+        if not existed:
+            self._save(name, content)
+        if self.add_reference(name, content.size) and existed:
+            # Новая запись ImageBlob: параллельный delete() мог снять
+            # последнюю ссылку и удалить файл после проверки exists().
+            self._save(name, content)
+        return name
+
+    def _save(self, name, content):
+        # Одно и то же содержимое могут записывать параллельно: файл
+        # пишется во временный и атомарно подменяется.
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        temp_path = f'{full_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, full_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name
+
+    @staticmethod
+    def add_reference(name, size):
+        """Добавляет ссылку; True, если запись ImageBlob создана заново."""
+        image_blob = apps.get_model('recipes', 'ImageBlob')
+        connection = connections[image_blob.objects.db]
+        if can_upsert(connection):
+            # Одна команда вместо UPDATE, SAVEPOINT и INSERT.
+            table = connection.ops.quote_name(image_blob._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (name, size, refcount, created) '
+                    f'VALUES (%s, %s, 1, %s) ON CONFLICT (name) DO UPDATE '
+                    f'SET refcount = {table}.refcount + 1 RETURNING refcount',
+                    [name, size, connection.ops.adapt_datetimefield_value(
+                        timezone.now()
+                    )]
+                )
+                return cursor.fetchone()[0] == 1
+        blobs = image_blob.objects.filter(name=name)
+        if blobs.update(refcount=F('refcount') + 1):
+            return False
+        try:
+            with transaction.atomic():
+                image_blob.objects.create(name=name, size=size, refcount=1)
+        except IntegrityError:
+            blobs.update(refcount=F('refcount') + 1)
+            return False
+        return True
+
+    def delete(self, name):
+        """Снимает ссылку на файл и удаляет его, когда ссылок не осталось."""
+        image_blob = apps.get_model('recipes', 'ImageBlob')
+        with transaction.atomic():
+            blob = image_blob.objects.select_for_update().filter(
+                name=name
+            ).first()
+            if blob is not None and blob.refcount > 1:
+                blob.refcount = F('refcount') - 1
+                blob.save(update_fields=['refcount'])
+                return
+            if blob is not None:
+                blob.delete()
+            # Файл удаляется, пока строка ещё заблокирована.
+            super().delete(name)
+
+
+cas_storage = ContentAddressedStorage()
@@ -0,0 +1,11 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """Списки по size элементов из iterable, последний может быть короче."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -10,7 +10,8 @@ User = get_user_model()
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'email', 'first_name', 'last_name', )
+    list_display = ('username', 'email', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count', )
     list_filter = ('email', 'username', )
     search_fields = ('username',)
 
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.16 on 2026-10-18 15:38
+
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def delete_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    User = apps.get_model('users', 'User')
+    duplicates = (
+        Follow.objects.values('follower', 'author')
+        .annotate(first_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    authors = set()
+    for duplicate in duplicates:
+        Follow.objects.filter(
+            follower=duplicate['follower'], author=duplicate['author']
+        ).exclude(id=duplicate['first_id']).delete()
+        authors.add(duplicate['author'])
+    if authors:
+        User.objects.filter(pk__in=authors).update(followers_count=Coalesce(
+            Subquery(
+                Follow.objects.filter(author=OuterRef('pk')).order_by()
+                .values('author').annotate(total=Count('pk'))
+                .values('total')
+            ), 0
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_follows,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_delete_duplicate_follows'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('follower', 'author'), name='UQ_follow_follower_author'),
+        ),
+    ]
@@ -14,6 +14,12 @@ class User(AbstractUser):
     )
     first_name = models.CharField('first name', max_length=150, blank=False)
     last_name = models.CharField('last name', max_length=150, blank=False)
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -46,3 +52,7 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'author'],
+                                    name='UQ_follow_follower_author')
+        ]